@@ -0,0 +1,222 @@
+#BACKGROUND SUBTRACTION
+
+"""
+Subtracts background posRuns (e.g. from background_routine.py) from the other
+posRuns in Run_Data. Each run is paired with the latest background taken
+before it whose positions cover the run's, the background is interpolated onto
+the run's positions and the difference is written next to the run as
+<run>-bgsub.csv, with the uncertainties added in quadrature. Runs are processed
+in parallel, one per process:
+
+    python Background.py                (every run in Run_Data)
+    python Background.py Run_Data/2021-03-01_14-43-08-FOIL4-primary.csv
+"""
+
+import os
+import csv
+import glob
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from RunLoader import loadRun, AXES, ERRORS
+from RunCatalog import FILENAME
+
+SUFFIX = '-bgsub.csv'
+
+
+def isBackground(path):
+    """
+    Returns:
+        bool: whether the file name tags it as a background run (including
+            the 'backgroun' typo of some early runs)
+    """
+    match = FILENAME.search(os.path.basename(path))
+    return bool(match) and 'backgroun' in match.group(2).lower()
+
+
+def derivedPath(path):
+    """
+    Returns:
+        string: where the background subtracted copy of path is written
+    """
+    return os.path.splitext(path)[0]+SUFFIX
+
+
+def runFiles(directory='Run_Data'):
+    """
+    Returns:
+        List[string]: the run files in directory, oldest first, leaving out
+            timing summaries, .csv exports of .run files and files written by
+            this module
+    """
+    paths = sorted(glob.glob(os.path.join(directory,'*.csv'))+glob.glob(os.path.join(directory,'*.run')))
+    return [os.path.normpath(path) for path in paths
+            if FILENAME.search(os.path.basename(path)) and not path.endswith(('-timing.csv','-average.csv',SUFFIX))
+            and not (path.endswith('.csv') and os.path.exists(path[:-len('.csv')]+'.run'))]
+
+
+def positionRange(path):
+    """
+    Returns:
+        tuple (float, float) or None: lowest and highest position of a
+            posRun, None for runs that stay at one position or can't be read
+    """
+    try:
+        data,metadata = loadRun(path)
+    except Exception:
+        return None
+    position = np.asarray(data['position'])
+    position = position[np.isfinite(position)]
+    if len(position) < 2 or position.min() == position.max():
+        return None
+    return float(position.min()),float(position.max())
+
+
+def pairBackgrounds(paths,backgrounds):
+    """pairs every run with the latest background taken before it whose
+       positions cover the run's
+
+    Args:
+        paths (List[string]): the runs to subtract from
+        backgrounds (List[string]): the candidate background runs
+
+    Returns:
+        dict: background file by run file, runs without a usable background
+            are left out
+    """
+    def started(path):
+        return datetime.strptime(FILENAME.search(os.path.basename(path)).group(1),'%Y-%m-%d_%H-%M-%S')
+
+    candidates = [(started(path),path,positionRange(path)) for path in backgrounds]
+    candidates = sorted(c for c in candidates if c[2] is not None)
+    pairs = {}
+    for path in paths:
+        span = positionRange(path)
+        if span is None:
+            continue
+        when = started(path)
+        for bgStarted,bgPath,bgSpan in reversed(candidates):
+            if bgStarted <= when and bgPath != path and bgSpan[0] <= span[0] and bgSpan[1] >= span[1]:
+                pairs[path] = bgPath
+                break
+    return pairs
+
+
+def subtract(run,background):
+    """subtracts a background from a run at the run's positions, all axes
+       of both fluxgates at once
+
+    Args:
+        run (structured array): the run as loaded by RunLoader.loadRun
+        background (structured array): the background run, positions in any
+            order
+
+    Returns:
+        tuple (ndarray, ndarray): run-background and its uncertainty, both
+            (n,6) in the order of RunLoader.AXES. The background is linearly
+            interpolated between its two nearest positions; missing background
+            uncertainties (runs from before the dx..dz2 columns) count as 0
+    """
+    order = np.argsort(background['position'],kind='stable')
+    bgPos = np.asarray(background['position'])[order]
+    bg = np.stack([np.asarray(background[name])[order] for name in AXES],1)
+    bgErr = np.nan_to_num(np.stack([np.asarray(background[name])[order] for name in ERRORS],1))
+    position = np.asarray(run['position'])
+
+    # one set of interpolation weights shared by all six columns
+    right = np.clip(np.searchsorted(bgPos,position),1,len(bgPos)-1)
+    left = right-1
+    width = bgPos[right]-bgPos[left]
+    w = np.divide(position-bgPos[left],width,out=np.zeros_like(position),where=width > 0)
+    w = np.clip(w,0,1)[:,None]
+    interpolated = (1-w)*bg[left]+w*bg[right]
+    interpolatedErr = np.hypot((1-w)*bgErr[left],w*bgErr[right])
+
+    values = np.stack([np.asarray(run[name]) for name in AXES],1)
+    errors = np.stack([np.asarray(run[name]) for name in ERRORS],1)
+    return values-interpolated,np.hypot(errors,interpolatedErr)
+
+
+def subtractFile(path,backgroundPath,force=False):
+    """writes the background subtracted copy of one run (see derivedPath)
+
+    Args:
+        path (string): the run file
+        backgroundPath (string): its background run
+        force (bool, optional): rewrite the copy even if it is newer than both
+            runs. Defaults to False.
+
+    Returns:
+        tuple (string, bool): the written file and whether it was (re)written
+    """
+    out = derivedPath(path)
+    if (not force and os.path.exists(out)
+            and os.path.getmtime(out) >= max(os.path.getmtime(path),os.path.getmtime(backgroundPath))):
+        return out,False
+    run,metadata = loadRun(path)
+    background,bgMetadata = loadRun(backgroundPath)
+    values,errors = subtract(run,background)
+
+    timestamps = np.char.replace(np.datetime_as_string(run['timestamp']),'T',' ')
+    columns = [timestamps,np.asarray(run['time']),np.asarray(run['position'])]+list(values.T)+list(errors.T)
+    with open(out,'w',newline='') as csvfile:
+        csvfile.write('# background: {}\n'.format(backgroundPath))
+        writer = csv.writer(csvfile)
+        writer.writerow(['timestamp','time','position']+AXES+ERRORS)
+        writer.writerows(zip(*columns))
+    return out,True
+
+
+def batch(paths=None,directory='Run_Data',workers=None,force=False):
+    """subtracts backgrounds from many runs in parallel
+
+    Args:
+        paths (List[string], optional): the runs to process. Defaults to None,
+            every non background run in directory.
+        directory (string, optional): where runs and backgrounds are looked
+            for. Defaults to 'Run_Data'.
+        workers (int, optional): processes to use. Defaults to None, one per
+            CPU.
+        force (bool, optional): rewrite copies that are up to date. Defaults
+            to False.
+
+    Returns:
+        List[string]: the background subtracted files, written or up to date
+    """
+    files = runFiles(directory)
+    backgrounds = [path for path in files if isBackground(path)]
+    if paths is None:
+        paths = [path for path in files if not isBackground(path)]
+    pairs = pairBackgrounds([os.path.normpath(path) for path in paths],backgrounds)
+    for path in paths:
+        if os.path.normpath(path) not in pairs:
+            print('no background for {}'.format(path))
+
+    written = []
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {path:pool.submit(subtractFile,path,bgPath,force) for path,bgPath in pairs.items()}
+        for path,future in futures.items():
+            try:
+                out,fresh = future.result()
+            except Exception as e:
+                print('could not subtract the background from {}: {}'.format(path,e))
+                continue
+            print('{} - {} -> {}{}'.format(path,os.path.basename(pairs[path]),out,'' if fresh else ' (up to date)'))
+            written.append(out)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='subtract background runs from the runs in Run_Data')
+    parser.add_argument('paths',nargs='*',help='runs to process, default every run in Run_Data')
+    parser.add_argument('--directory',default='Run_Data')
+    parser.add_argument('--workers',type=int)
+    parser.add_argument('--force',action='store_true',help='rewrite files that are up to date')
+    args = parser.parse_args()
+    written = batch(args.paths or None,args.directory,args.workers,args.force)
+    print('{} background subtracted runs'.format(len(written)))
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,163 @@
 #FLUXGATE
 
+import math
+import time
 import numpy as np
 
+# stream result keys for the six fluxgate AINs, x1,y1,z1,x2,y2,z2
+AIN_KEYS = ['AIN{}'.format(i) for i in range(6)]
+
+
+def reducePacket(r):
+    """reduces one labjack stream result to a mean and stdev per AIN in a
+       single (channels x samples) numpy pass
+
+    Args:
+        r (dict): a result yielded by labjack.streamData(), containing the
+            lists 'AIN0' to 'AIN5'
+
+    Returns:
+        tuple (float_array(2,3), float_array(2,3)): the average for each
+            fluxgate and axis, the stdev for each fluxgate and axis
+    """
+    channels = [r[key] for key in AIN_KEYS]
+    n = min(len(c) for c in channels)
+    # a short packet can leave the channels one sample ragged, drop the extra
+    if any(len(c) != n for c in channels):
+        channels = [c[:n] for c in channels]
+    data = np.array(channels)
+    return (data.mean(1).reshape(2,3),data.std(1).reshape(2,3))
+
+
+# FG2 is mounted rotated relative to FG1: its x and z axes are swapped and all
+# three point the opposite way
+FG2_ORDER = [2,1,0]
+FG2_SIGN = -1
+# derived columns, gradient FG1-FG2 then common mode (FG1+FG2)/2, in FG1 axes
+GRADIENT_FIELDS = ['gx','gy','gz','cx','cy','cz','dgx','dgy','dgz','dcx','dcy','dcz']
+
+
+def fieldGradient(mean,err):
+    """turns FG2 into FG1's axes and computes the difference and common mode
+       of the two fluxgates
+
+    Args:
+        mean (float_array(...,2,3)): the average for each fluxgate and axis,
+            as returned by reducePacket or a sampler
+        err (float_array(...,2,3)): the matching uncertainties
+
+    Returns:
+        tuple (float_array(...,2,3), float_array(...,2,3)): the gradient
+            FG1-FG2 and the common mode (FG1+FG2)/2 per axis, and their
+            uncertainties, the two fluxgates' added in quadrature
+    """
+    mean = np.asarray(mean)
+    err = np.asarray(err)
+    fg1 = mean[...,0,:]
+    fg2 = FG2_SIGN*mean[...,1,FG2_ORDER]
+    spread = np.hypot(err[...,0,:],err[...,1,FG2_ORDER])
+    return np.stack([fg1-fg2,(fg1+fg2)/2],-2),np.stack([spread,spread/2],-2)
+
+
+def gradientColumns(column):
+    """fieldGradient of a batch of rows at once, e.g. the rows a run writer is
+       about to write (see RunFile.runWriter)
+
+    Args:
+        column (Callable[[string], float_array(n,)]): gives the values of the
+            column x1..z2 or dx1..dz2 of the given name for every row
+
+    Returns:
+        dict: the GRADIENT_FIELDS columns by name, each float_array(n,)
+    """
+    mean = np.stack([column(name) for name in ['x1','y1','z1','x2','y2','z2']],-1).reshape(-1,2,3)
+    err = np.stack([column(name) for name in ['dx1','dy1','dz1','dx2','dy2','dz2']],-1).reshape(-1,2,3)
+    derived = np.concatenate([part.reshape(-1,6) for part in fieldGradient(mean,err)],1)
+    return {name:derived[:,i] for i,name in enumerate(GRADIENT_FIELDS)}
+
+
+def waitForSettle(sampler,threshold,window=5,timeout=2):
+    """reads short windows of samples until the stdev of every channel within
+       a window drops below threshold, e.g. once the carriage has stopped
+       vibrating after a step
+
+    Args:
+        sampler (FluxgatePair or StreamBurst): sampler to read from
+        threshold (float): largest stdev in V on any axis of either fluxgate
+            for the signal to count as settled
+        window (int, optional): number of samples per window. Defaults to 5.
+        timeout (float, optional): seconds after which to give up waiting and
+            carry on. Defaults to 2.
+
+    Returns:
+        float: seconds waited until the signal settled (or timeout)
+    """
+    start = time.perf_counter()
+    while True:
+        settled = np.max(np.std(sampler.samples(window),0)) < threshold
+        elapsed = time.perf_counter()-start
+        if settled or elapsed > timeout:
+            return elapsed
+
+
+def sampleToTarget(sampler,target,minSamples=5,maxSamples=500,batch=5):
+    """keeps sampling until the standard error of the mean (std/sqrt(n)) of
+       every axis of both fluxgates is below target, or maxSamples is reached
+
+    Args:
+        sampler (FluxgatePair or StreamBurst): sampler to read from
+        target (float): standard error of the mean to reach, in V
+        minSamples (int, optional): samples taken before the first check, at
+            least 2 since a single sample has no spread. Defaults to 5.
+        maxSamples (int, optional): most samples taken at one position.
+            Defaults to 500.
+        batch (int, optional): samples read between checks. Defaults to 5.
+
+    Returns:
+        tuple (float_array(2,3), float_array(2,3), int): the average for each
+            fluxgate and axis, the standard error of the mean for each fluxgate
+            and axis, and the number of samples taken
+    """
+    samples = sampler.samples(min(max(minSamples,2),maxSamples))
+    while True:
+        n = len(samples)
+        err = np.std(samples,0)/np.sqrt(n)
+        if np.max(err) < target or n >= maxSamples:
+            return (np.average(samples,0),err,n)
+        samples = np.concatenate((samples,sampler.samples(min(batch,maxSamples-n))))
+
+
+class ScanAssembler:
+    """turns successive labjack stream results into whole scans of the six
+       AINs, carrying over a scan that was split across two results and
+       keeping a running scan index
+    """
+
+    def __init__(self):
+        self.scan = 0
+        self.pending = [[] for key in AIN_KEYS]
+
+    def add(self,r):
+        """adds one stream result
+
+        Args:
+            r (dict): a result yielded by labjack.streamData()
+
+        Returns:
+            tuple (int_array(n,), float_array(n,6)): the scan index of each
+                complete scan and its six AIN values, x1,y1,z1,x2,y2,z2
+        """
+        channels = [self.pending[i]+list(r[key]) for i,key in enumerate(AIN_KEYS)]
+        n = min(len(c) for c in channels)
+        self.pending = [c[n:] for c in channels]
+        data = np.array([c[:n] for c in channels]).T.reshape(n,len(AIN_KEYS))
+        # missed scans still advance the device clock
+        self.scan += r['missed']
+        scans = self.scan+np.arange(n)
+        self.scan += n
+        return scans,data
+
+
 class Fluxgate:
 
     def __init__(self,labjack,num):
@@ -34,4 +190,132 @@ class Fluxgate:
         samples = np.zeros((samples_per_pos,3))
         for i in range(samples_per_pos):
             samples[i,:]=self.labjack.readRegister(self.xReg,self.registers)
-        return (np.average(samples,0),np.std(samples,0)/np.sqrt(samples_per_pos))
\ No newline at end of file
+        return (np.average(samples,0),np.std(samples,0)/np.sqrt(samples_per_pos))
+
+
+class FluxgatePair:
+    """reads both fluxgates together, one readRegister call covering all twelve
+       registers (AIN0-5) per sample, so that fluxgate 1 and fluxgate 2 are
+       sampled at the same instant
+    """
+
+    def __init__(self,labjack):
+        self.labjack = labjack
+        self.firstReg = 0
+        self.registers = 12
+
+    def samples(self,samples_per_pos):
+        """reads raw samples from both fluxgates
+
+        Args:
+            samples_per_pos (int): number of samples to read
+
+        Returns:
+            float_array(samples_per_pos,2,3): the samples, indexed by
+                [sample, fluxgate, axis]
+        """
+        samples = np.zeros((samples_per_pos,6))
+        for i in range(samples_per_pos):
+            samples[i,:]=self.labjack.readRegister(self.firstReg,self.registers)
+        return samples.reshape(samples_per_pos,2,3)
+
+    def sample(self,samples_per_pos):
+        """takes a single measurement from both fluxgates
+
+        Args:
+            samples_per_pos (int): number of samples averaged together for each
+                measurement.
+
+        Returns:
+            tuple (float_array(2,3), float_array(2,3)): the average for each
+                fluxgate and axis, the standard error of the mean for each
+                fluxgate and axis
+        """
+        samples = self.samples(samples_per_pos)
+        return (np.average(samples,0),np.std(samples,0)/np.sqrt(samples_per_pos))
+
+
+class StreamBurst:
+    """samples all six fluxgate AINs (x1,y1,z1,x2,y2,z2) with a short hardware
+       timed stream burst instead of one readRegister round trip per sample
+    """
+
+    # AIN0-2 are fluxgate 1, AIN3-5 are fluxgate 2
+    CHANNELS = range(6)
+
+    def __init__(self,labjack,scanFreq=5000):
+        """
+        Args:
+            labjack (u6.U6): an open labjack
+            scanFreq (int, optional): the number of times per second the
+                Labjack reads the set of 6 AINs during a burst. Defaults to
+                5000. Max 8000.
+        """
+        self.labjack = labjack
+        self.scanFreq = scanFreq
+
+    def configure(self):
+        """configures the labjack stream, call once before the first burst
+        """
+        self.labjack.getCalibrationData()
+        self.labjack.streamConfig(NumChannels=len(self.CHANNELS),ResolutionIndex=1,SettlingFactor=0,ChannelNumbers=self.CHANNELS,ChannelOptions=[0]*len(self.CHANNELS),ScanFrequency=self.scanFreq)
+
+    def scans(self,samples_per_pos):
+        """streams until at least samples_per_pos scans have been read
+
+        Args:
+            samples_per_pos (int): number of scans of all six AINs to capture
+
+        Returns:
+            float_array(6,samples_per_pos): the raw scans, one row per AIN
+        """
+        # size a single request so that one USB read holds the whole burst
+        # (a request is at most 48 packets)
+        samplesNeeded = samples_per_pos*len(self.CHANNELS)
+        packetsPerRequest = self.labjack.packetsPerRequest
+        self.labjack.packetsPerRequest = min(48,max(1,math.ceil(samplesNeeded/self.labjack.streamSamplesPerPacket)))
+        data = [[] for i in self.CHANNELS]
+        self.labjack.streamStart()
+        try:
+            for r in self.labjack.streamData():
+                if r is None:
+                    continue
+                if r['missed'] != 0:
+                    print("+++ Missed ", r['missed'])
+                for i in self.CHANNELS:
+                    data[i].extend(r[AIN_KEYS[i]])
+                if len(data[-1]) >= samples_per_pos:
+                    break
+        finally:
+            self.labjack.streamStop()
+            # leave the request size as it was for later streams
+            self.labjack.packetsPerRequest = packetsPerRequest
+        return np.array([d[:samples_per_pos] for d in data])
+
+    def samples(self,samples_per_pos):
+        """streams raw samples from both fluxgates, same layout as
+           FluxgatePair.samples
+
+        Args:
+            samples_per_pos (int): number of scans to read
+
+        Returns:
+            float_array(samples_per_pos,2,3): the samples, indexed by
+                [sample, fluxgate, axis]
+        """
+        return self.scans(samples_per_pos).T.reshape(samples_per_pos,2,3)
+
+    def sample(self,samples_per_pos):
+        """takes a single measurement from both fluxgates in one burst
+
+        Args:
+            samples_per_pos (int): number of scans averaged together for each
+                measurement.
+
+        Returns:
+            tuple (float_array(2,3), float_array(2,3)): the average for each
+                fluxgate and axis, the standard error of the mean for each
+                fluxgate and axis
+        """
+        samples = self.samples(samples_per_pos)
+        return (samples.mean(0),samples.std(0)/np.sqrt(samples_per_pos))
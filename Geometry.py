@@ -0,0 +1,14 @@
+#GEOMETRY
+
+"""
+Dimensions of the rig shared by the acquisition, simulation and analysis code.
+"""
+
+import numpy as np
+
+# offset in cm of each channel's sensing point from the measured position, in
+# the order x1, y1, z1, x2, y2, z2 (see Resample)
+OFFSETS = np.array([-3,0,-1.5,-3,0,-1.5])
+# ends of the shield in cm, on the scale of the measured position
+SHIELDSTART = 20
+SHIELDSTOP = 60
@@ -16,14 +16,18 @@ import atexit
 import time
 import json
 import sys
+from datetime import datetime
 import numpy as np
 
-# This is for remote development. If true it will be able to be used without physical access to the gradiometer
-# Note this is only for testing, if this is set to true the GUI will not be functional
+# This is for remote development. If true the GUI runs against the simulated labjack and motor in Simulation.py,
+# so it can be used without physical access to the gradiometer
 remoteDev = False
 
-if not remoteDev:
-    from Gradiometer import Gradiometer
+from Gradiometer import Gradiometer
+from Simulation import simulatedBackend
+from Geometry import OFFSETS, SHIELDSTART, SHIELDSTOP
+from Fluxgate import FG2_ORDER, FG2_SIGN
+from RepeatAverage import RepeatAggregator
 
 # Enables matplotlib with pyqt
 matplotlib.use('Qt5Agg')
@@ -40,7 +44,7 @@ def initGrad():
     Returns:
         Gradiometer: gradiometer that has just been initialized
     """
-    g = Gradiometer()
+    g = Gradiometer(*simulatedBackend()) if remoteDev else Gradiometer()
     atexit.register(g.motor.turnOffMotors)
     atexit.register(g.savePos)
     atexit.register(g.labjack.close)
@@ -159,17 +163,13 @@ class CalibrationWindow(QMainWindow):
             "<p>The gradiometer carriage should now move approximately {}cm. Once it's done, take a tape measure and measure this distance precisely. Your measurement will be used to calibrate future step sizes. Enter the measured distance in cm in the space below (will appear when motor finishes moving). </p>".format(self.calDist))
 
         # Sets up thread for moving the gradiometer so UI thread doesn't block
-        if not remoteDev:
-            self.gradiometer = initGrad()
-            self.gradiometer.zero()
+        self.gradiometer = initGrad()
+        self.gradiometer.zero()
 
         def goToThread():
             """Helper function that wraps gradiometer running
             """
-            if not remoteDev:
-                self.steps = self.gradiometer.goTo(self.calDist)
-            else:
-                self.steps = 700
+            self.steps = self.gradiometer.goTo(self.calDist)
 
         # Start physical movement thread
         thread = threading.Thread(target=goToThread)
@@ -232,14 +232,18 @@ class RunWindow(QMainWindow):
 
     datamutex = threading.Lock()
 
-    # Start and stop of shield in centimeters
-    SHIELDSTART = 20
-    SHIELDSTOP = 60
+    # Start and stop of shield in centimeters (see Geometry)
+    SHIELDSTART = SHIELDSTART
+    SHIELDSTOP = SHIELDSTOP
     # Between two points to graph
     MINGRAPH = 0
     MAXGRAPH = 80
     # Frequency with which to graph
     GRAPHFREQ = 3
+    # Running average of repeated position runs, None until a position run starts
+    aggregator = None
+    # RepeatAggregator direction of the position run in progress
+    passDirection = RepeatAggregator.INCREASING
 
     class RunModes():
         """Enum for run modes"""
@@ -393,9 +397,24 @@ class RunWindow(QMainWindow):
         self.operateButton.setEnabled(False)
         # Nest callback is kind of confusing, there's probably an easier way to do things
         # Basically gradCallback is called every time a measurement is made, while a lambda that uses this callback is given to the thread to run
-        gradCallback = lambda i: self.gradiometer.posRun(
-            start if i%2==0 else stop, stop if i%2==0 else start, tag, graph=False, samples_per_pos=samplesPerPos, mes_callback=self.updateData)
+        def gradCallback(i):
+            # Every other repeat scans back, increasing and decreasing passes are averaged separately because of backlash
+            first, last = (start, stop) if i%2==0 else (stop, start)
+            with self.datamutex:
+                if i == 0:
+                    self.aggregator = RepeatAggregator(start, stop, self.gradiometer.CM_PER_STEP)
+                self.passDirection = RepeatAggregator.INCREASING if last >= first else RepeatAggregator.DECREASING
+            self.gradiometer.posRun(first, last, tag, graph=False, samples_per_pos=samplesPerPos, mes_callback=self.updateData)
+            if repeats > 1 and i == repeats-1:
+                with self.datamutex:
+                    filename = 'Run_Data/{}-{}-average.csv'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), tag)
+                    self.aggregator.save(filename)
+                print('average of {} repeats saved to {}'.format(repeats, filename))
         self.gradThread = threading.Thread(target=lambda: self.repeatRun(repeats, gradCallback))
+        # Average profiles, fluxgate 1 in black and 2 in grey, increasing passes solid and decreasing dashed
+        if not hasattr(self, 'averageRefs'):
+            self.averageRefs = [[[self.plotRefs[i].plot([], [], pen=pg.mkPen(color, width=2, style=style))
+                                  for style in [Qt.SolidLine, Qt.DashLine]] for color in ['k', (150, 150, 150)]] for i in range(3)]
         for i in range(6):
             # Right now I'm just settting the axis in a hardcoded way to get them to line up as per Beatrice's request, but if dynamic spacing is required this should work: 
             # self.axes[i].set_xlim([min(self.axes[i].get_xlim()[0], min(
@@ -456,13 +475,17 @@ class RunWindow(QMainWindow):
             # Not strictly necessary, just put it in to physically be able to differentiate runs
             time.sleep(1)
 
-    def updateData(self, pos1, pos2, std1, std2): 
+    def updateData(self, pos1, pos2, std1, std2, position=None): 
         """Updates data, to be called from gradThread Args (All in (x, y, ) format):
             pos1 (List[Float]): List of magnetic fields at position 1
             pos2 (List[Float]): List of magnetic fields at position 2
             std1 (List[Float]): List of standard deviations for pos 1
             std2 (List[Float]): List of standard deviations for pos 1
+            position (Float, optional): Position in cm the measurement was taken at, the gradiometer's
+                current position if not given
         """
+        if position is None:
+            position = self.gradiometer.pos
         self.datamutex.acquire()
         try: 
             # Conversion factor given in user manual
@@ -472,15 +495,17 @@ class RunWindow(QMainWindow):
                 self.ydata[i][-1] = np.append(self.ydata[i][-1], uTPerVolt*pos1[i])
                 self.error[i][-1] = np.append(self.error[i][-1], uTPerVolt*std1[i])
                 if self.mode == self.RunModes.pos:
-                    self.xdata[i][-1] = np.append(self.xdata[i][-1], self.gradiometer.pos + self.getOffset(i))
+                    self.xdata[i][-1] = np.append(self.xdata[i][-1], position + self.getOffset(i))
                     # Since pos2 has rotated axes a shifting must be done
-                    index = 2 if i==0 else (0 if i == 2 else 1)
-                    self.ydataPos2[i][-1] = np.append(self.ydataPos2[i][-1], -uTPerVolt*pos2[index])
+                    index = FG2_ORDER[i]
+                    self.ydataPos2[i][-1] = np.append(self.ydataPos2[i][-1], FG2_SIGN*uTPerVolt*pos2[index])
                     self.errorPos2[i][-1] = np.append(self.errorPos2[i][-1], uTPerVolt*std2[index])
                 elif self.mode == self.RunModes.time:
                     if len(self.xdata[i][-1]) == 0:
                         self.startTime = time.time()
                     self.xdata[i][-1] = np.append(self.xdata[i][-1], time.time()-self.startTime)
+            if self.mode == self.RunModes.pos and self.aggregator:
+                self.aggregator.add(position, self.passDirection, list(pos1)+list(pos2), list(std1)+list(std2))
         finally:
             self.datamutex.release()
 
@@ -488,6 +513,13 @@ class RunWindow(QMainWindow):
         """Updates graphs periodically"""
         self.datamutex.acquire()
         try: 
+            if self.mode == self.RunModes.pos and self.aggregator:
+                uTPerVolt = 10
+                for direction in [RepeatAggregator.INCREASING, RepeatAggregator.DECREASING]:
+                    position, mean, sem, n = self.aggregator.profile(direction)
+                    for i in range(3):
+                        self.averageRefs[i][0][direction].setData(position + self.getOffset(i), uTPerVolt*mean[:, i])
+                        self.averageRefs[i][1][direction].setData(position + self.getOffset(i), FG2_SIGN*uTPerVolt*mean[:, 3+FG2_ORDER[i]])
             for i in range(self.numPlots):
                 try:
                     vb = self.plotRefs[i].getViewBox()                     
@@ -521,17 +553,12 @@ class RunWindow(QMainWindow):
         """Get's offset of magnetometer inherent in instrument
 
         Args:
-            i (int): axis, 1=x, 2=y, 3=z
+            i (int): axis, 0=x, 1=y, 2=z
 
         Returns:
-            int: offset of the given axis
+            float: offset of the given axis in cm (see Geometry.OFFSETS)
         """
-        if i == 0:
-            return -3
-        elif i == 1:
-            return 0
-        elif i == 2:
-            return -1.5
+        return OFFSETS[i]
 
 # Main entry point
 if __name__ == '__main__':
@@ -1,62 +1,179 @@
+import os
 import sys
+import inspect
 import traceback
 import atexit
 import pickle
 import numpy as np
 import matplotlib.pyplot as plt
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import csv
 import json
 from datetime import datetime
 import time as timer
 
-# Hardware includes
-import u6
-from Motor import Motor
-from Fluxgate import Fluxgate
+from Fluxgate import Fluxgate, FluxgatePair, StreamBurst, ScanAssembler, reducePacket, sampleToTarget, waitForSettle, fieldGradient, gradientColumns, GRADIENT_FIELDS
+from StreamReader import StreamReader
+from RawCapture import RawCapture
+from ScanPlanner import refineSegments
+from Timing import StageTimer, NullTimer
+from RunFile import runWriter
+from RunLoader import loadRun
+from Geometry import OFFSETS
+from Progress import Progress
+from MotionProfile import stepTimes, followSchedule
+import RunCatalog
+
+
+def withPosition(callback):
+    """
+    Args:
+        callback (Callable or None): a mes_callback
+
+    Returns:
+        Callable or None: callback if it takes a position keyword (or any
+            keywords), otherwise a wrapper that drops the position, so
+            callbacks written for the four list signature keep working
+    """
+    if callback is None:
+        return None
+    try:
+        parameters = inspect.signature(callback).parameters.values()
+    except (TypeError,ValueError):
+        parameters = []
+    if any(p.name == 'position' or p.kind == p.VAR_KEYWORD for p in parameters):
+        return callback
+    return lambda *values, position=None: callback(*values)
 
 class Gradiometer:
 
     # This is a good baseline and it's being kept in case file saving fails, but this value is reloaded from config.json
     # This means editing this number won't do anything
     CM_PER_STEP = 0.082268
+    # Steps the motor turns after a direction reversal before the belt engages and the carriage moves, 2-3 per the user manual
+    # Also reloaded from config.json if it has a BACKLASH_STEPS entry
+    BACKLASH_STEPS = 3
+    # Direction goTo finishes its moves in, 1 for increasing position (BACKWARD steps) and -1 for decreasing (FORWARD steps)
+    APPROACH = 1
+    # Top speed in cm/s, acceleration in cm/s^2 and ramp shape ('trapezoid' or 'scurve') of goTo moves, see MotionProfile
+    # Also reloaded from config.json if it has MAX_SPEED, ACCELERATION or PROFILE entries (see setMotion)
+    # MAX_SPEED is None until it has been calibrated with motion_calibration.py, goTo then steps at the motor's
+    # set 30 RPM without a ramp, since steps lost at an untested speed would put self.pos off
+    MAX_SPEED = None
+    ACCELERATION = 40
+    PROFILE = 'trapezoid'
 
-    def __init__(self):
-        
-        self.motor = Motor()
+    def __init__(self,labjack=None,motor=None):
+        """
+        Args:
+            labjack (optional): the DAQ backend, anything with the u6.U6
+                readRegister and stream interface. Defaults to None, which opens
+                the real U6.
+            motor (optional): the stepper backend, anything with the Motor
+                interface (mh, myStepper and turnOffMotors). Defaults to None,
+                which uses the real MotorHAT.
+                See Simulation.simulatedBackend for simulated ones.
+        """
+        # Hardware includes, only needed when using the real hardware
+        if motor is None:
+            from Motor import Motor
+            motor = Motor()
+        if labjack is None:
+            import u6
+            labjack = u6.U6()
+
+        self.motor = motor
+        # self.pos is where the carriage actually is and self.commandedPos where the motor steps alone would have put it,
+        # they differ by the belt slack that has been taken up (see trackSteps)
+        self.commandedPos = None
+        self.slack = None
         self.pos = self.loadPos()
         self.CM_PER_STEP = self.loadCal()
-        self.labjack = u6.U6()
+        self.BACKLASH_STEPS = self.loadBacklash()
+        self.MAX_SPEED,self.ACCELERATION,self.PROFILE = self.loadMotion()
+        if self.slack is None:
+            # belt state unknown, assume it is engaged for the usual approach direction
+            self.slack = self.BACKLASH_STEPS if self.APPROACH > 0 else 0
+            self.commandedPos = self.pos
+        self.slack = min(max(self.slack,0),self.BACKLASH_STEPS)
+        self.labjack = labjack
         self.fg1 = Fluxgate(self.labjack,1)
         self.fg2 = Fluxgate(self.labjack,2)
+        self.fgs = FluxgatePair(self.labjack)
 
-    def goTo(self,cm):
-        """moves the fluxgate to the position cm, rounded to the nearest step
+    def goTo(self,cm,stages=None,approach=None,fast=None):
+        """moves the fluxgate to the position cm, rounded to the nearest step.
+           The move always ends travelling in the approach direction, so the
+           belt is engaged for the following steps in that direction: a target
+           on the other side is overshot by BACKLASH_STEPS and approached back.
+           Steps taking up belt slack are added on top (see trackSteps), at the
+           target already only the slack is taken up
 
         Args:
             cm (float): position in cm you want the fluxgate to move to
+            stages (Timing.StageTimer, optional): if given, the move is timed
+                as the stage 'goTo'. Defaults to None.
+            approach (int, optional): 1 to finish with increasing position,
+                -1 with decreasing, e.g. the direction of the run that follows.
+                Defaults to None, which uses APPROACH.
+            fast (bool, optional): if True, the motor speeds up to MAX_SPEED
+                at ACCELERATION and slows down again (see MotionProfile),
+                otherwise it steps at the motor's set speed of 30 RPM.
+                Defaults to None, which is True once MAX_SPEED has been
+                calibrated (see setMotion) and False until then.
 
         Returns:
-            int: number of steps to take
+            int: number of steps the carriage moved (an overshoot counts both
+                ways), leaving out the motor steps that only took up belt
+                slack, e.g. for calibrating CM_PER_STEP
         """
-        dis = cm-self.pos
-        steps = round(abs(dis/self.CM_PER_STEP))
+        if approach is None:
+            approach = self.APPROACH
+        if fast is None:
+            fast = self.MAX_SPEED is not None
+        elif fast and self.MAX_SPEED is None:
+            raise ValueError('MAX_SPEED has not been calibrated, see motion_calibration.py')
+        carriageSteps = round((cm-self.pos)/self.CM_PER_STEP)
         print('goTo: starting at', self.pos)
-        print('goTo: will take',steps,'steps')
-        if dis>0:
-            self.motor.myStepper.step(steps, self.motor.mh.BACKWARD, self.motor.mh.DOUBLE)
-            self.setPos(self.pos+(self.CM_PER_STEP*steps))
-        elif dis<0:
-            self.motor.myStepper.step(steps, self.motor.mh.FORWARD, self.motor.mh.DOUBLE)
-            self.setPos(self.pos-(self.CM_PER_STEP*steps))
-        else:
+        t = stages.start() if stages else None
+        moves = []
+        if carriageSteps*approach < 0:
+            # go past the target so the last steps come from the approach side
+            moves.append((-approach,abs(carriageSteps)+self.BACKLASH_STEPS))
+            carriageSteps = approach*self.BACKLASH_STEPS
+        moves.append((approach,abs(carriageSteps)))
+        steps = 0
+        moved = 0
+        for sign,count in moves:
+            # the motor turns extra steps to take up the slack before the carriage moves,
+            # at the target already only those are taken
+            motorSteps = count+self.takeUp(sign)
+            if motorSteps == 0:
+                continue
+            direction = self.motor.mh.BACKWARD if sign > 0 else self.motor.mh.FORWARD
+            if fast:
+                times = stepTimes(motorSteps,self.MAX_SPEED/self.CM_PER_STEP,self.ACCELERATION/self.CM_PER_STEP,self.PROFILE)
+                followSchedule(times,lambda: self.motor.myStepper.oneStep(direction, self.motor.mh.DOUBLE))
+            else:
+                self.motor.myStepper.step(motorSteps, direction, self.motor.mh.DOUBLE)
+            moved += self.trackSteps(sign,motorSteps)
+            steps += motorSteps
+        if steps == 0:
             print('already at position')
+        else:
+            print('goTo: took',steps,'steps,',moved,'of them moving the carriage')
+        if stages:
+            stages.record('goTo',t)
         print('goTo: finished at position',self.pos)
         #self.motor.turnOffMotors()
-        return steps
+        return moved
     
     def oneStep(self, direction):
-        """makes the stepper motor take one step in the specified direction
+        """makes the stepper motor take one step in the specified direction.
+           Right after a reversal the step only takes up belt slack and the
+           carriage stays put (see trackSteps)
 
         Args:
             direction (int): 1 for forwards  (use self.motor.mh.FORWARD)
@@ -64,16 +181,50 @@ class Gradiometer:
         """
         if direction == self.motor.mh.BACKWARD:
             self.motor.myStepper.oneStep(direction, self.motor.mh.DOUBLE)
-            self.setPos(self.pos+self.CM_PER_STEP)
+            self.trackSteps(1,1)
         elif direction == self.motor.mh.FORWARD:
             self.motor.myStepper.oneStep(direction, self.motor.mh.DOUBLE)
-            self.setPos(self.pos-self.CM_PER_STEP)
+            self.trackSteps(-1,1)
         else:
             print("invalid direction, must be self.motor.mh.FORWARD or self.motor.mh.BACKWARD")
             # maybe this should throw an error instead?
+
+    def takeUp(self,sign):
+        """
+        Args:
+            sign (int): 1 for increasing position (BACKWARD), -1 for decreasing
+                (FORWARD)
+
+        Returns:
+            int: motor steps in that direction that only take up belt slack
+        """
+        return self.BACKLASH_STEPS-self.slack if sign > 0 else self.slack
+
+    def trackSteps(self,sign,steps):
+        """updates the commanded and actual position after the motor turned.
+           self.slack counts the slack taken up towards increasing positions,
+           BACKLASH_STEPS when the belt is engaged for BACKWARD steps and 0 when
+           it is engaged for FORWARD steps. The carriage only moves on the steps
+           left over once the slack is taken up
+
+        Args:
+            sign (int): 1 for increasing position (BACKWARD), -1 for decreasing
+                (FORWARD)
+            steps (int): motor steps taken
+
+        Returns:
+            int: steps the carriage actually moved
+        """
+        self.commandedPos += sign*steps*self.CM_PER_STEP
+        takeUp = min(steps,self.takeUp(sign))
+        self.slack += sign*takeUp
+        moved = steps-takeUp
+        self.setPos(self.pos+sign*moved*self.CM_PER_STEP)
+        return moved
     
     def loadPos(self):
-        """reads fluxgate position from the binary file 'POSITION.pickle'
+        """reads fluxgate position from the binary file 'POSITION.pickle',
+           and the commanded position and belt slack if they were saved too
 
         Returns:
             float: previously saved position of fluxgate
@@ -86,14 +237,18 @@ class Gradiometer:
             self.savePos()
             self.loadPos()
         posFile.close()
+        if isinstance(pos,dict):
+            self.commandedPos = pos['commanded']
+            self.slack = pos['slack']
+            pos = pos['pos']
         return pos
     
     def savePos(self):
-        """saves the current fluxgate position self.pos to the binary file 
-           'POSITION.pickle'
+        """saves the current fluxgate position self.pos, the commanded
+           position and the belt slack to the binary file 'POSITION.pickle'
         """
         posFile = open('POSITION.pickle','wb')
-        pickle.dump(self.pos, posFile)
+        pickle.dump({'pos':self.pos,'commanded':self.commandedPos,'slack':self.slack}, posFile)
         posFile.close()
         print('saved pos')
     
@@ -103,9 +258,72 @@ class Gradiometer:
 
         return data['CM_PER_STEP']
 
+    def loadBacklash(self):
+        """
+        Returns:
+            int: the calibrated backlash in steps from config.json, or
+                BACKLASH_STEPS if it hasn't been calibrated
+        """
+        with open('./config.json') as f:
+            data = json.load(f)
+
+        return int(data.get('BACKLASH_STEPS',self.BACKLASH_STEPS))
+
+    def loadMotion(self):
+        """
+        Returns:
+            tuple (float, float, string): the top speed in cm/s, acceleration
+                in cm/s^2 and ramp shape of goTo moves from config.json, or
+                MAX_SPEED (None, uncalibrated), ACCELERATION and PROFILE for
+                the ones it doesn't have
+        """
+        with open('./config.json') as f:
+            data = json.load(f)
+
+        maxSpeed = data.get('MAX_SPEED',self.MAX_SPEED)
+        return (None if maxSpeed is None else float(maxSpeed),float(data.get('ACCELERATION',self.ACCELERATION)),
+                data.get('PROFILE',self.PROFILE))
+
+    def setMotion(self,maxSpeed,acceleration,profile='trapezoid'):
+        """saves a calibrated goTo motion profile to config.json, e.g. the
+           one found by motion_calibration.py. From then on goTo speeds up to
+           maxSpeed by default
+
+        Args:
+            maxSpeed (float): top speed in cm/s the motor keeps up with
+            acceleration (float): (peak) acceleration in cm/s^2
+            profile (string, optional): 'trapezoid' or 'scurve'. Defaults to
+                'trapezoid'.
+        """
+        with open('./config.json') as f:
+            data = json.load(f)
+        data['MAX_SPEED'] = maxSpeed
+        data['ACCELERATION'] = acceleration
+        data['PROFILE'] = profile
+        with open('./config.json','w') as f:
+            json.dump(data,f)
+        self.MAX_SPEED,self.ACCELERATION,self.PROFILE = maxSpeed,acceleration,profile
+
+    def setBacklash(self,steps):
+        """saves a calibrated backlash to config.json, e.g. the number of steps
+           counted before the carriage moves after a reversal
+
+        Args:
+            steps (int): motor steps taken up by the belt on a reversal
+        """
+        with open('./config.json') as f:
+            data = json.load(f)
+        data['BACKLASH_STEPS'] = steps
+        with open('./config.json','w') as f:
+            json.dump(data,f)
+        self.BACKLASH_STEPS = steps
+        self.slack = min(self.slack,steps)
+
     def zero(self):
         """sets fluxgate position to zero
         """
+        if self.commandedPos is not None:
+            self.commandedPos -= self.pos
         self.setPos(0)
     
     def setPos(self,x):
@@ -124,9 +342,9 @@ class Gradiometer:
         """
         return self.pos
     
-    def posRun(self,start,stop,tag,graph=False,samples_per_pos=5, mes_callback=None):
+    def posRun(self,start,stop,tag,graph=False,samples_per_pos=5, mes_callback=None, burst=False, scanFreq=5000, pipeline=False, settle=None, settleWindow=5, settleTimeout=2, target=None, maxSamples=500, timing=True, fmt='csv', verbosity=1, gradient=True, grad_callback=None, directory='Run_Data'):
         """a measurement mode where the gradiometer takes a measurement at every
-           step in a range. Saves results in a .csv in /Run_Data/
+           step in a range. Saves results in a .csv in /Run_Data/ (or directory)
 
         Args:
             start (float): starting position of the measurement run in cm
@@ -140,19 +358,101 @@ class Gradiometer:
             mes_callback (Callable[[List[float], List[float], List[Float], List[Float]], None]): 
                 A callback function to be called every time a measurement is taken. 
                 First list passed is [x1, y1, z1], second is [x2, y2, z2], third is [dx1, dy1, dz1]
-                and third is [dx2, dy2, dz2]
+                and third is [dx2, dy2, dz2]. If the callback takes a keyword argument position, it is
+                passed the position in cm the measurement was taken at, which self.pos may already
+                have moved on from
+            burst (bool, optional): if True, each position is sampled with a
+                short hardware timed stream burst of all six AINs instead of
+                one readRegister call per sample (covering both fluxgates).
+                Defaults to False.
+            scanFreq (int, optional): the scan frequency of the stream burst,
+                only used if burst is True. Defaults to 5000. Max 8000.
+            pipeline (bool, optional): if True, printing, saving and
+                mes_callback for each measurement run on a separate thread
+                while the motor takes the next step. Defaults to False.
+            settle (float, optional): if given, after each step the fluxgates
+                are read in windows of settleWindow samples until the stdev of
+                every axis within a window is below settle (in V), and only
+                then is the measurement taken. The time waited is saved in an
+                extra 'settle' column. Defaults to None (no settling).
+            settleWindow (int, optional): samples per settle window. Defaults
+                to 5.
+            settleTimeout (float, optional): longest time in seconds to wait for
+                the signal to settle at a position. Defaults to 2.
+            target (float, optional): if given, each position is sampled until
+                the standard error of the mean of every axis is below target
+                (in V), starting with samples_per_pos samples and adding more
+                up to maxSamples. The number of samples taken is saved in an
+                extra 'n' column. Defaults to None (always samples_per_pos).
+            maxSamples (int, optional): most samples taken at one position when
+                target is given. Defaults to 500.
+            timing (bool, optional): if True, the time taken by every settle,
+                sample, step, print, write and callback is recorded (see
+                Timing.StageTimer) and a summary is printed and saved to a
+                -timing.csv next to the .csv. Defaults to True.
+            fmt (string, optional): 'csv' to save the run as a .csv, 'run' for
+                the columnar binary .run format with the run settings in its
+                header (see RunFile). Defaults to 'csv'.
+            verbosity (int, optional): 0 to print no measurements, 1 to print
+                at most one per second, 2 to print every measurement (see
+                Progress). Defaults to 1.
+            gradient (bool, optional): if True, the gradient FG1-FG2 and the
+                common mode (FG1+FG2)/2 of every measurement, with FG2 turned
+                into FG1's axes, are saved in the extra columns gx..gz, cx..cz
+                and their uncertainties dgx..dcz. They are computed for each
+                batch of rows as it is written (see Fluxgate.gradientColumns).
+                Defaults to True.
+            grad_callback (Callable[[List[float], List[float], List[Float], List[Float]], None]):
+                A callback function to be called with every measurement's
+                gradient [gx, gy, gz], common mode [cx, cy, cz] and their
+                uncertainties [dgx, dgy, dgz] and [dcx, dcy, dcz], only
+                computed one measurement at a time for it. Only used if
+                gradient is True. Defaults to None.
+            directory (string, optional): folder the run and its -timing.csv
+                are saved in, the run is added to the catalog.sqlite in it (see
+                RunCatalog). Defaults to 'Run_Data'.
+
+        Returns:
+            dict: summary of the run with the keys 'filename', 'positions'
+                (number of positions measured), 'samples' (total samples
+                taken), 'seconds' (run time), 'stages' (the StageTimer.summary
+                of the run, empty if timing is False) and 'interrupted' (True
+                if the run was stopped before reaching stop)
         """
-        filename = 'Run_Data/{}-{}.csv'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),tag)
-        csvfile = open(filename, 'w')
+        mes_callback = withPosition(mes_callback)
+        runName = os.path.join(directory,'{}-{}'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),tag))
         fieldnames = ['timestamp','time','position',
                       'x1','y1','z1',
                       'x2','y2','z2',
                       'dx1','dy1','dz1',
                       'dx2','dy2','dz2']
-        writer = csv.DictWriter(csvfile,fieldnames)
-        writer.writeheader()
+        if settle:
+            fieldnames.append('settle')
+        if target:
+            fieldnames.append('n')
+        if gradient:
+            fieldnames += GRADIENT_FIELDS
+        metadata = {'mode':'posRun','tag':tag,'start':start,'stop':stop,
+                    'samples_per_pos':samples_per_pos,'burst':burst,'scanFreq':scanFreq if burst else None,
+                    'settle':settle,'target':target,'CM_PER_STEP':self.CM_PER_STEP,
+                    'simulated':getattr(self.labjack,'SIMULATED',False),'startTime':datetime.now()}
+        writer = runWriter(runName,fieldnames,metadata,fmt,gradientColumns if gradient else None)
+        filename = writer.filename
+
+        if burst:
+            sampler = StreamBurst(self.labjack,scanFreq)
+            sampler.configure()
+        else:
+            # both fluxgates in one readRegister call per sample
+            sampler = self.fgs
+
+        # print, write and callback run on the output thread when pipelined
+        # and on the stepping thread otherwise
+        stages = StageTimer() if timing else NullTimer()
+        progress = Progress(verbosity)
 
-        self.goTo(start)
+        # arrive with the belt engaged for the run's direction, so the first step moves the carriage
+        self.goTo(start,stages,approach=1 if stop >= start else -1)
         print('starting run at {}cm'.format(self.pos))
 
         dis = stop-self.pos
@@ -163,40 +463,340 @@ class Gradiometer:
             direction = self.motor.mh.BACKWARD
         else:
             direction = self.motor.mh.FORWARD
+
+        def output(timeStamp,time,position,mean,err,extra):
+            """prints, saves and sends out one measurement
+            """
+            t = stages.start()
+            [x1,y1,z1],[x2,y2,z2] = mean
+            [dx1,dy1,dz1],[dx2,dy2,dz2] = err
+            progress.show('measuring at {:3.4f}cm, x1={:2.3f} y1={:2.3f} z1={:2.3f}, x2={:2.3f} y2={:2.3f} z2={:2.3f}',position,x1,y1,z1,x2,y2,z2)
+            t = stages.record('print',t)
+            row = {'timestamp':timeStamp,'time':time,
+                   'position':position,
+                   'x1':x1,'y1':y1,'z1':z1,
+                   'x2':x2,'y2':y2,'z2':z2,
+                   'dx1':dx1,'dy1':dy1,'dz1':dz1,
+                   'dx2':dx2,'dy2':dy2,'dz2':dz2}
+            # optional columns, e.g. settle and n, the gradient ones are filled in by the writer
+            row.update(extra)
+            writer.writerow(row)
+            t = stages.record('write',t)
+
+            if mes_callback:
+                mes_callback([x1,y1,z1], [x2,y2,z2], [dx1,dy1,dz1], [dx2,dy2,dz2], position=position)
+                t = stages.record('callback',t)
+            if gradient and grad_callback:
+                # gradient, common mode, and their uncertainties
+                grad_callback(*np.concatenate(fieldGradient(mean,err)).tolist())
+                stages.record('callback',t)
+
+        # a single worker keeps the rows in order
+        executor = ThreadPoolExecutor(max_workers=1) if pipeline else None
+        pending = []
+        positions = 0
+        samplesTaken = 0
+        interrupted = False
         try:
             for step in range(steps):
+                extra = {}
+                t = stages.start()
+                if settle:
+                    extra['settle'] = waitForSettle(sampler,settle,settleWindow,settleTimeout)
+                    t = stages.record('settle',t)
                 timeStamp = datetime.now()
                 time = (timeStamp-startTime).total_seconds()
                 position = self.pos
-                [x1,y1,z1],[dx1,dy1,dz1] = self.fg1.sample(samples_per_pos)
-                [x2,y2,z2],[dx2,dy2,dz2] = self.fg2.sample(samples_per_pos)
-                t = timer.time()
-                print('measuring at {:3.4f}cm, x1={:2.3f} y1={:2.3f} z1={:2.3f}, x2={:2.3f} y2={:2.3f} z2={:2.3f}'.format(self.pos,x1,y1,z1,x2,y2,z2))
-                writer.writerow({'timestamp':timeStamp,'time':time,
-                                 'position':position,
-                                 'x1':x1,'y1':y1,'z1':z1,
-                                 'x2':x2,'y2':y2,'z2':z2,
-                                 'dx1':dx1,'dy1':dy1,'dz1':dz1,
-                                 'dx2':dx2,'dy2':dy2,'dz2':dz2})
-
-                if mes_callback:
-                    mes_callback([x1,y1,z1], [x2,y2,z2], [dx1,dy1,dz1], [dx2,dy2,dz2])
+                if target:
+                    mean,err,extra['n'] = sampleToTarget(sampler,target,samples_per_pos,maxSamples)
+                else:
+                    mean,err = sampler.sample(samples_per_pos)
+                stages.record('sample',t)
+                positions += 1
+                samplesTaken += extra.get('n',samples_per_pos)
 
+                # measurement i is written while the carriage moves to step i+1
+                if executor:
+                    pending.append(executor.submit(output,timeStamp,time,position,mean,err,extra))
+                else:
+                    output(timeStamp,time,position,mean,err,extra)
+
+                t = stages.start()
                 self.oneStep(direction)
+                stages.record('step',t)
             print('finished at {}cm'.format(self.pos))
         except KeyboardInterrupt:
             print('run stopped at {}cm'.format(self.pos))
+            interrupted = True
         finally:
-            csvfile.close()
+            if executor:
+                executor.shutdown(wait=True)
+            writer.close()
             self.motor.turnOffMotors()
             self.savePos()
+            total = (datetime.now()-startTime).total_seconds()
+            print('run took {:.2f}s'.format(total))
+            stages.report(runName+'-timing.csv')
+        # re-raise anything that went wrong while writing
+        for future in pending:
+            future.result()
+        self.catalogRun(filename,metadata,os.path.join(directory,'catalog.sqlite'))
 
         if graph:
             self.plotter(filename,mode=1)
 
-    def timeRun(self,sec,tag,cm=None,graph=False,scanFreq=1000, mes_callback=None):
+        return {'filename':filename,'positions':positions,'samples':samplesTaken,
+                'seconds':total,'stages':stages.summary(),'interrupted':interrupted}
+
+    def flyRun(self,start,stop,tag,speed=2,scanFreq=5000,graph=False,mes_callback=None):
+        """a measurement mode where the carriage moves at constant velocity
+           while all six AINs are streamed continuously. Every scan is given a
+           position by interpolating between the recorded step times, and the
+           scans are then averaged per step, so the .csv in /Run_Data/ has the
+           same columns (gradient ones included) and one row per step like
+           Gradiometer.posRun
+
+        Args:
+            start (float): starting position of the measurement run in cm
+            stop (float): ending position of the measurement run in cm
+            tag (string): a string that will be included in the file name of the
+                .csv file
+            speed (float, optional): carriage speed in cm/s. Defaults to 2.
+            scanFreq (int, optional): The number of times per second the Labjack
+                reads the set of 6 AINs. Defaults to 5000. Max 8000.
+            graph (bool, optional): determines whether a graph of the raw data
+                will be shown at the end of the run. Defaults to False.
+            mes_callback (Callable[[List[float], List[float], List[Float], List[Float]], None]): 
+                A callback function called for every row once the scans have
+                been binned, same arguments as in Gradiometer.posRun
+        """
+        mes_callback = withPosition(mes_callback)
+        runName = 'Run_Data/{}-{}'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),tag)
+        fieldnames = ['timestamp','time','position',
+                      'x1','y1','z1',
+                      'x2','y2','z2',
+                      'dx1','dy1','dz1',
+                      'dx2','dy2','dz2']
+        fieldnames += GRADIENT_FIELDS
+
+        self.labjack.getCalibrationData()
+        self.labjack.streamConfig(NumChannels=6,ResolutionIndex=1,SettlingFactor=0,ChannelNumbers=range(6),ChannelOptions=[0]*6,ScanFrequency=scanFreq)
+
+        self.goTo(start,approach=1 if stop >= start else -1)
+        print('starting run at {}cm'.format(self.pos))
+        startPos = self.pos
+
+        dis = stop-self.pos
+        steps = math.ceil(abs(dis/self.CM_PER_STEP))
+        if dis>0:
+            direction = self.motor.mh.BACKWARD
+            cmPerStep = self.CM_PER_STEP
+        else:
+            direction = self.motor.mh.FORWARD
+            cmPerStep = -self.CM_PER_STEP
+        print('will take {} steps at {}cm/s'.format(steps,speed))
+
+        # step times and positions, used to interpolate a position for each scan
+        stepClock = []
+        stepPos = []
+        stopMotion = threading.Event()
+
+        def move():
+            """steps the motor on a fixed schedule, recording when each step
+               finished
+            """
+            interval = self.CM_PER_STEP/speed
+            t = timer.time()
+            stepClock.append(t)
+            stepPos.append(self.pos)
+            for step in range(steps):
+                if stopMotion.is_set():
+                    break
+                t += interval
+                delay = t-timer.time()
+                if delay>0:
+                    timer.sleep(delay)
+                self.oneStep(direction)
+                stepClock.append(timer.time())
+                stepPos.append(self.pos)
+
+        assembler = ScanAssembler()
+        scanChunks = []
+        dataChunks = []
+        reader = None
+        mover = threading.Thread(target=move)
+        try:
+            self.labjack.streamStart()
+            t0 = timer.time()
+            reader = StreamReader(self.labjack)
+            reader.start()
+            mover.start()
+            while mover.is_alive():
+                item = reader.get()
+                if item is StreamReader.DONE:
+                    break
+                timeStamp,r = item
+                if r is None:
+                    continue
+                if r['missed'] != 0:
+                    print("+++ Missed ", r['missed'])
+                scans,data = assembler.add(r)
+                scanChunks.append(scans)
+                dataChunks.append(data)
+            print('finished at {}cm'.format(self.pos))
+        except KeyboardInterrupt:
+            print('run stopped at {}cm'.format(self.pos))
+        finally:
+            stopMotion.set()
+            if mover.is_alive():
+                mover.join()
+            if reader:
+                reader.stop()
+            self.labjack.streamStop()
+            self.motor.turnOffMotors()
+            self.savePos()
+
+        if not dataChunks or len(stepClock)<2:
+            print('no data')
+            return
+
+        # device time of every scan, on the same clock as the step times
+        t = t0+np.concatenate(scanChunks)/scanFreq
+        data = np.concatenate(dataChunks)
+        inMotion = (t>=stepClock[0])&(t<=stepClock[-1])
+        t = t[inMotion]
+        data = data[inMotion]
+        position = np.interp(t,stepClock,stepPos)
+
+        # average the scans per step, all channels at once
+        k = np.clip(np.round((position-startPos)/cmPerStep).astype(int),0,steps)
+        counts = np.bincount(k,minlength=steps+1)
+        filled = counts>0
+        n = counts[filled][:,None]
+        mean = np.stack([np.bincount(k,data[:,i],steps+1) for i in range(6)],1)[filled]/n
+        sq = (data-mean[np.cumsum(filled)[k]-1])**2
+        err = np.sqrt(np.stack([np.bincount(k,sq[:,i],steps+1) for i in range(6)],1)[filled]/n)/np.sqrt(n)
+        binTime = np.bincount(k,t,steps+1)[filled]/n[:,0]
+        binPos = startPos+cmPerStep*np.nonzero(filled)[0]
+
+        # the gradient columns are filled in by the writer, as in posRun
+        writer = runWriter(runName,fieldnames,derive=gradientColumns)
+        filename = writer.filename
+        for j in range(len(binPos)):
+            x1,y1,z1,x2,y2,z2 = mean[j]
+            dx1,dy1,dz1,dx2,dy2,dz2 = err[j]
+            writer.writerow({'timestamp':datetime.fromtimestamp(binTime[j]),
+                             'time':binTime[j]-t0,
+                             'position':binPos[j],
+                             'x1':x1,'y1':y1,'z1':z1,
+                             'x2':x2,'y2':y2,'z2':z2,
+                             'dx1':dx1,'dy1':dy1,'dz1':dz1,
+                             'dx2':dx2,'dy2':dy2,'dz2':dz2})
+            if mes_callback:
+                mes_callback([x1,y1,z1], [x2,y2,z2], [dx1,dy1,dz1], [dx2,dy2,dz2], position=binPos[j])
+        writer.close()
+        print('{} scans averaged into {} positions'.format(len(t),len(binPos)))
+        self.catalogRun(filename,{'mode':'flyRun','tag':tag,'scanFreq':scanFreq})
+
+        if graph:
+            self.plotter(filename,mode=1)
+
+    def refineRun(self,start,stop,tag,coarseStep=1,gradient=0.01,curvature=0.005,graph=False,samples_per_pos=5,mes_callback=None):
+        """a position run that first measures every coarseStep cm, then goes
+           back and measures at every step only where the coarse pass shows a
+           large gradient or curvature (see ScanPlanner.refineSegments). Both
+           passes are saved, sorted by position, in a .csv in /Run_Data/ with
+           the Gradiometer.posRun columns (gradient ones included) and an extra
+           'pass' column (0 coarse, 1 fine)
+
+        Args:
+            start (float): starting position of the measurement run in cm
+            stop (float): ending position of the measurement run in cm
+            tag (string): a string that will be included in the file name of the
+                .csv file
+            coarseStep (float, optional): spacing of the coarse pass in cm.
+                Defaults to 1.
+            gradient (float, optional): refine where any channel changes by
+                more than this many V/cm between coarse points. Defaults to 0.01.
+            curvature (float, optional): refine where the second difference of
+                any channel is more than this many V/cm^2, None to only use
+                gradient. Defaults to 0.005.
+            graph (bool, optional): determines whether a graph of the raw data 
+                will be shown at the end of the run. Defaults to False.
+            samples_per_pos (int, optional): number of samples averaged together
+                for each measurement. Defaults to 5.
+            mes_callback (Callable[[List[float], List[float], List[Float], List[Float]], None]): 
+                A callback function to be called every time a measurement is
+                taken, same arguments as in Gradiometer.posRun
+        """
+        mes_callback = withPosition(mes_callback)
+        runName = 'Run_Data/{}-{}'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),tag)
+        fieldnames = ['timestamp','time','position',
+                      'x1','y1','z1',
+                      'x2','y2','z2',
+                      'dx1','dy1','dz1',
+                      'dx2','dy2','dz2','pass']+GRADIENT_FIELDS
+        rows = []
+        startTime = datetime.now()
+
+        def measure(runPass):
+            """samples both fluxgates at the current position and keeps the row
+            """
+            timeStamp = datetime.now()
+            [[x1,y1,z1],[x2,y2,z2]],[[dx1,dy1,dz1],[dx2,dy2,dz2]] = self.fgs.sample(samples_per_pos)
+            print('measuring at {:3.4f}cm, x1={:2.3f} y1={:2.3f} z1={:2.3f}, x2={:2.3f} y2={:2.3f} z2={:2.3f}'.format(self.pos,x1,y1,z1,x2,y2,z2))
+            rows.append({'timestamp':timeStamp,'time':(timeStamp-startTime).total_seconds(),
+                         'position':self.pos,
+                         'x1':x1,'y1':y1,'z1':z1,
+                         'x2':x2,'y2':y2,'z2':z2,
+                         'dx1':dx1,'dy1':dy1,'dz1':dz1,
+                         'dx2':dx2,'dy2':dy2,'dz2':dz2,'pass':runPass})
+            if mes_callback:
+                mes_callback([x1,y1,z1], [x2,y2,z2], [dx1,dy1,dz1], [dx2,dy2,dz2], position=self.pos)
+
+        try:
+            coarse = np.arange(start,stop,coarseStep if stop>start else -coarseStep)
+            coarse = np.append(coarse,stop)
+            print('coarse pass: {} positions every {}cm'.format(len(coarse),coarseStep))
+            for cm in coarse:
+                self.goTo(cm,approach=1 if stop >= start else -1)
+                measure(0)
+
+            order = np.argsort([row['position'] for row in rows])
+            position = np.array([rows[i]['position'] for i in order])
+            values = np.array([[rows[i][key] for key in ['x1','y1','z1','x2','y2','z2']] for i in order])
+            segments = refineSegments(position,values,gradient,curvature)
+            print('fine pass: refining {}'.format(', '.join('{:.1f}-{:.1f}cm'.format(a,b) for a,b in segments) or 'nothing'))
+
+            for a,b in segments:
+                self.goTo(a,approach=1)
+                for step in range(math.ceil((b-a)/self.CM_PER_STEP)+1):
+                    # skip the points the coarse pass already measured
+                    if np.min(np.abs(position-self.pos)) > self.CM_PER_STEP/2:
+                        measure(1)
+                    self.oneStep(self.motor.mh.BACKWARD)
+            print('finished at {}cm'.format(self.pos))
+        except KeyboardInterrupt:
+            print('run stopped at {}cm'.format(self.pos))
+        finally:
+            self.motor.turnOffMotors()
+            self.savePos()
+            rows.sort(key=lambda row: row['position'])
+            # the gradient columns are filled in by the writer, as in posRun
+            writer = runWriter(runName,fieldnames,derive=gradientColumns)
+            filename = writer.filename
+            for row in rows:
+                writer.writerow(row)
+            writer.close()
+            print('{} positions saved'.format(len(rows)))
+        self.catalogRun(filename,{'mode':'refineRun','tag':tag,'samples_per_pos':samples_per_pos})
+
+        if graph:
+            self.plotter(filename,mode=1)
+
+    def timeRun(self,sec,tag,cm=None,graph=False,scanFreq=1000, mes_callback=None, queueSize=64, raw=False, timing=True, fmt='csv', verbosity=1, gradient=True, grad_callback=None, directory='Run_Data'):
         """Takes continuous measurements at a dingle position for an amount of
-           time. Saves results in a .csv in /Run_Data/
+           time. Saves results in a .csv in /Run_Data/ (or directory)
 
         Args:
             sec (int): the number of seconds to measure for
@@ -213,15 +813,59 @@ class Gradiometer:
             mes_callback (Callable[[List[float], List[float], List[Float], List[Float]], None]): 
                 A callback function to be called every time a measurement is taken. 
                 First list passed is [x1, y1, z1], second is [x2, y2, z2], third is [dx1, dy1, dz1]
-                and third is [dx2, dy2, dz2]
+                and third is [dx2, dy2, dz2], with the position as in Gradiometer.posRun
+            queueSize (int, optional): maximum number of stream results buffered
+                between the stream reader thread and the reduction/writing
+                loop. Defaults to 64.
+            raw (bool, optional): if True, every scan of all six AINs is also
+                saved at the full scan frequency to a -raw.npy file next to the
+                .csv (see RawCapture). Defaults to False.
+            timing (bool, optional): if True, the time spent waiting for each
+                stream result and reducing, saving, printing and sending it out
+                is recorded (see Timing.StageTimer) and a summary is printed
+                and saved to a -timing.csv next to the .csv. Defaults to True.
+            fmt (string, optional): 'csv' to save the run as a .csv, 'run' for
+                the columnar binary .run format with the run settings in its
+                header (see RunFile). Defaults to 'csv'.
+            verbosity (int, optional): 0 to print no measurements, 1 to print
+                at most one per second, 2 to print every measurement (see
+                Progress). Defaults to 1.
+            gradient (bool, optional): if True, the gradient FG1-FG2 and the
+                common mode (FG1+FG2)/2 of every measurement, with FG2 turned
+                into FG1's axes, are saved in the extra columns gx..gz, cx..cz
+                and their uncertainties dgx..dcz. They are computed for each
+                batch of rows as it is written (see Fluxgate.gradientColumns).
+                Defaults to True.
+            grad_callback (Callable[[List[float], List[float], List[Float], List[Float]], None]):
+                A callback function to be called with every measurement's
+                gradient [gx, gy, gz], common mode [cx, cy, cz] and their
+                uncertainties [dgx, dgy, dgz] and [dcx, dcy, dcz], only
+                computed one measurement at a time for it. Only used if
+                gradient is True. Defaults to None.
+            directory (string, optional): folder the run and its -timing.csv
+                are saved in, the run is added to the catalog.sqlite in it (see
+                RunCatalog). Defaults to 'Run_Data'.
+
+        Returns:
+            dict: summary of the run with the keys 'filename', 'requests'
+                (stream results read), 'scans' (scans read, less the missed
+                ones), 'missed' (scans lost), 'highWater' (most results waiting
+                in the queue), 'seconds' (run time), 'stages' (the
+                StageTimer.summary of the run, empty if timing is False) and
+                'interrupted' (True if an error ended the run early)
         """
         if cm==None:
             cm=self.getPos()
-        filename = 'Run_Data/{}-{}.csv'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),tag)
-        csvfile = open(filename, 'w')
+        mes_callback = withPosition(mes_callback)
+        runName = os.path.join(directory,'{}-{}'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'),tag))
         fieldnames = ['timestamp','time','position','x1','y1','z1','x2','y2','z2','dx1','dy1','dz1','dx2','dy2','dz2']
-        writer = csv.DictWriter(csvfile,fieldnames)
-        writer.writeheader()
+        if gradient:
+            fieldnames += GRADIENT_FIELDS
+        metadata = {'mode':'timeRun','tag':tag,'sec':sec,'position':cm,
+                    'scanFreq':scanFreq,'CM_PER_STEP':self.CM_PER_STEP,
+                    'simulated':getattr(self.labjack,'SIMULATED',False),'startTime':datetime.now()}
+        writer = runWriter(runName,fieldnames,metadata,fmt,gradientColumns if gradient else None)
+        filename = writer.filename
 
         ainchannels = range(6)
         channeloptions = [0] * 6
@@ -232,20 +876,36 @@ class Gradiometer:
         missed = 0
         dataCount = 0
         packetCount = 0
+        stages = StageTimer() if timing else NullTimer()
+        progress = Progress(verbosity)
 
-        self.goTo(cm)
+        self.goTo(cm,stages)
         print('starting run at {}cm'.format(self.pos))
         position = self.getPos()
+        startTime = datetime.now()
+        reader = None
+        rawCapture = RawCapture(runName+'-raw.npy',scanFreq) if raw else None
+        interrupted = False
 
         try:
             self.labjack.streamStart()
             startTime = datetime.now()
             print('starting run at {}'.format(startTime))
 
-            for r in self.labjack.streamData():
+            # USB reads happen on the reader thread, this loop only consumes
+            reader = StreamReader(self.labjack,queueSize)
+            reader.start()
+
+            while True:
+                t = stages.start()
+                item = reader.get()
+                t = stages.record('wait',t)
+                if item is StreamReader.DONE:
+                    break
+                timeStamp,r = item
                 if r is not None:
                     #stop condition
-                    if (datetime.now()-startTime).seconds > sec:
+                    if (timeStamp-startTime).seconds > sec:
                         break
                     if r['errors'] != 0:
                         print("Error: %s ; " % r['errors'], datetime.now())
@@ -255,39 +915,33 @@ class Gradiometer:
                         missed += r['missed']
                         print("+++ Missed ", r['missed'])
                     
-                    timeStamp = datetime.now()
                     time = (timeStamp-startTime).total_seconds() 
-                    x1 = r['AIN0']
-                    y1 = r['AIN1']
-                    z1 = r['AIN2']
-                    x2 = r['AIN3']
-                    y2 = r['AIN4']
-                    z2 = r['AIN5']
-
-                    x1val = sum(x1)/len(x1)
-                    y1val = sum(y1)/len(y1)
-                    z1val = sum(z1)/len(z1)
-                    x2val = sum(x2)/len(x2)
-                    y2val = sum(y2)/len(y2)
-                    z2val = sum(z2)/len(z2)
-                    
-                    dx1 = np.std(x1)
-                    dy1 = np.std(y1)
-                    dz1 = np.std(z1)
-                    dx2 = np.std(x2)
-                    dy2 = np.std(y2)
-                    dz2 = np.std(z2)
+                    if rawCapture:
+                        rawCapture.append(r)
+                        t = stages.record('raw',t)
+                    mean,err = reducePacket(r)
+                    [[x1val,y1val,z1val],[x2val,y2val,z2val]],[[dx1,dy1,dz1],[dx2,dy2,dz2]] = mean,err
+                    t = stages.record('reduce',t)
 
                     if mes_callback:
-                        mes_callback([x1val,y1val,z1val], [x2val,y2val,z2val], [dx1,dy1,dz1], [dx2,dy2,dz2])
+                        mes_callback([x1val,y1val,z1val], [x2val,y2val,z2val], [dx1,dy1,dz1], [dx2,dy2,dz2], position=position)
+                        t = stages.record('callback',t)
+                    if gradient and grad_callback:
+                        # gradient, common mode, and their uncertainties
+                        grad_callback(*np.concatenate(fieldGradient(mean,err)).tolist())
+                        t = stages.record('callback',t)
 
-                    print('measuring at {:4.2f}, x1={:2.3f} y1={:2.3f} z1={:2.3f}, x2={:2.3f} y2={:2.3f} z2={:2.3f}'.format(time,x1val,y1val,z1val,x2val,y2val,z2val))
-                    writer.writerow({'timestamp':timeStamp, 'time':time,
-                                     'position':position,
-                                     'x1':x1val,'y1':y1val,'z1':z1val,
-                                     'x2':x2val,'y2':y2val,'z2':z2val,
-                                     'dx1':dx1,'dy1':dy1,'dz1':dz1,
-                                     'dx2':dx2,'dy2':dy2,'dz2':dz2})
+                    progress.show('measuring at {:4.2f}, x1={:2.3f} y1={:2.3f} z1={:2.3f}, x2={:2.3f} y2={:2.3f} z2={:2.3f}',time,x1val,y1val,z1val,x2val,y2val,z2val)
+                    t = stages.record('print',t)
+                    row = {'timestamp':timeStamp, 'time':time,
+                           'position':position,
+                           'x1':x1val,'y1':y1val,'z1':z1val,
+                           'x2':x2val,'y2':y2val,'z2':z2val,
+                           'dx1':dx1,'dy1':dy1,'dz1':dz1,
+                           'dx2':dx2,'dy2':dy2,'dz2':dz2}
+                    # the gradient columns are filled in by the writer
+                    writer.writerow(row)
+                    stages.record('write',t)
 
                     dataCount += 1
                     packetCount += r['numPackets']
@@ -299,43 +953,83 @@ class Gradiometer:
             tb = sys.exc_info()[-1]
             print(traceback.extract_tb(tb, limit=1)[-1][1]) # Print what line the Exception occured on
             print(e) #  Print the exception
+            interrupted = True
         finally:
             stopTime = datetime.now()
+            if reader:
+                reader.stop()
+                print('stream queue high-water mark: {}/{} results'.format(reader.highWater,queueSize))
             self.labjack.streamStop()
             #self.labjack.close()
             print('ending run at {}'.format(stopTime))
             sampleTotal = packetCount * self.labjack.streamSamplesPerPacket
             scanTotal = sampleTotal / len(ainchannels)
-            print("{} requests with {} packets per request with {} samples per packet = {} samples total.".format(dataCount, (float(packetCount)/dataCount), self.labjack.streamSamplesPerPacket, sampleTotal))
+            print("{} requests with {} packets per request with {} samples per packet = {} samples total.".format(dataCount, (float(packetCount)/max(dataCount,1)), self.labjack.streamSamplesPerPacket, sampleTotal))
             print("{} samples were lost due to errors.".format(missed))
             scanTotal -= missed
             print ("Adjusted total: {}".format(scanTotal))
-            csvfile.close()
+            writer.update({'missed':missed})
+            writer.close()
+            if rawCapture:
+                rawCapture.close()
+            stages.report(runName+'-timing.csv')
             #self.motor.turnOffMotors()
             self.savePos()
+        self.catalogRun(filename,metadata,os.path.join(directory,'catalog.sqlite'))
         
         if graph==True:
             self.plotter(filename,mode=2)
+
+        return {'filename':filename,'requests':dataCount,'scans':scanTotal,'missed':missed,
+                'highWater':reader.highWater if reader else 0,
+                'seconds':(stopTime-startTime).total_seconds(),'stages':stages.summary(),
+                'interrupted':interrupted}
     
+    def catalogRun(self,filename,metadata,catalog=RunCatalog.CATALOG):
+        """adds a finished run to the Run_Data catalog (see RunCatalog).
+           A failure here is only reported, it never stops a run
+
+        Args:
+            filename (string): the run file
+            metadata (dict): run settings, e.g. mode, tag, samples_per_pos
+            catalog (string, optional): path of the catalog database. Defaults
+                to Run_Data/catalog.sqlite.
+        """
+        try:
+            RunCatalog.addRun(filename,metadata,catalog)
+        except Exception as e:
+            print('could not add {} to the run catalog: {}'.format(filename,e))
+
     def plotter(self,csvfile,mode):
         """shows a plot of raw gradiometer data
 
         Args:
-            csvfile (string): the path to a .csv file containing gradiometer data
+            csvfile (string): the path to a .csv (or .run) file containing
+                gradiometer data
             mode (int): 1 for a .csv produced by Gradiometer.posRun
                         2 for a .csv produced by Gradiometer.timeRun
         """
-        results = np.loadtxt(csvfile, delimiter=',', skiprows=1, usecols=[1,2,3,4,5,6,7,8])
+        # parsed once, later plots of the same file load the cached copy
+        data,metadata = loadRun(csvfile)
+        results = np.stack([data[key] for key in ['time','position','x1','y1','z1','x2','y2','z2']],1)
         print(results.dtype)
-        fig,[ax1,ax2]=plt.subplots(2,1,sharex=True)
+        # runs saved with the gradient columns get a third plot of FG1-FG2
+        gradient = np.isfinite(data['gx']).any()
+        fig,axes=plt.subplots(3 if gradient else 2,1,sharex=True)
+        ax1,ax2 = axes[:2]
         ax1.grid()
         ax1.set_title('Fluxgate 1')
         ax2.grid()
         ax2.set_title('Fluxgate 2')
+        if gradient:
+            ax3 = axes[2]
+            ax3.grid()
+            ax3.set_title('Gradient FG1-FG2')
+            gx,gy,gz = data['gx'],data['gy'],data['gz']
         time = results[:,0]
         y1pos = results[:,1]
-        z1pos = y1pos-1.5
-        x1pos = y1pos-3
+        z1pos = y1pos+OFFSETS[2]
+        x1pos = y1pos+OFFSETS[0]
         x1 = results[:,2]
         y1 = results[:,3]
         z1 = results[:,4]
@@ -345,10 +1039,14 @@ class Gradiometer:
         if mode==1:
             ax1.plot(x1pos,x1,y1pos,y1,z1pos,z1)
             ax2.plot(x1pos,x2,y1pos,y2,z1pos,z2)
+            if gradient:
+                ax3.plot(x1pos,gx,y1pos,gy,z1pos,gz)
             plt.show()
         if mode==2:
             ax1.plot(time,x1,time,y1,time,z1)
             ax2.plot(time,x2,time,y2,time,z2)
+            if gradient:
+                ax3.plot(time,gx,time,gy,time,gz)
             plt.show()
 
 
@@ -0,0 +1,89 @@
+#MOTION PROFILE
+
+import time
+import numpy as np
+
+# distance covered while ramping from v0 to v, times a/(v^2-v0^2), per shape:
+# constant acceleration, or a raised cosine velocity ramp (S-curve) whose peak
+# acceleration is a
+RAMP = {'trapezoid':0.5,'scurve':np.pi/4}
+
+
+def stepTimes(steps,maxSpeed,acceleration,shape='trapezoid',startSpeed=1):
+    """times at which to take each step of a move that speeds up to maxSpeed,
+       cruises and slows down again, ramping at acceleration. Moves too short
+       to reach maxSpeed turn around at a lower peak speed
+
+    Args:
+        steps (int): number of steps in the move
+        maxSpeed (float): top speed in steps/s
+        acceleration (float): (peak) acceleration in steps/s^2
+        shape (string, optional): 'trapezoid' for constant acceleration ramps,
+            'scurve' for smooth raised cosine ramps. Defaults to 'trapezoid'.
+        startSpeed (float, optional): speed in steps/s at the start and end
+            of the move, one the motor can start at from rest. Defaults to 1.
+
+    Returns:
+        float_array(steps,): time in s from the start of the move for each
+            step, the first at 0
+    """
+    if steps <= 0:
+        return np.zeros(0)
+    k = RAMP[shape]
+    v0 = min(startSpeed,maxSpeed)
+    # each ramp may cover at most half the move
+    peak = min(maxSpeed,np.sqrt(acceleration*(steps-1)/(2*k)+v0**2))
+    rampDistance = k*(peak**2-v0**2)/acceleration
+    rampTime = 2*rampDistance/(v0+peak)
+    cruiseTime = max(steps-1-2*rampDistance,0)/peak
+    total = 2*rampTime+cruiseTime
+
+    # distance against time on a fine grid, inverted by interpolation
+    t = np.linspace(0,total,max(20*steps,1000))
+    if rampTime > 0:
+        u = np.clip(t/rampTime,0,1)
+        if shape == 'scurve':
+            ramp = v0*u*rampTime+(peak-v0)/2*rampTime*(u-np.sin(np.pi*u)/np.pi)
+        else:
+            ramp = v0*u*rampTime+(peak-v0)/2*rampTime*u**2
+    else:
+        ramp = np.zeros_like(t)
+    cruise = peak*np.clip(t-rampTime,0,cruiseTime)
+    # the slow down mirrors the speed up
+    tail = np.clip(total-t,0,rampTime)
+    if rampTime > 0:
+        u = tail/rampTime
+        if shape == 'scurve':
+            remaining = v0*u*rampTime+(peak-v0)/2*rampTime*(u-np.sin(np.pi*u)/np.pi)
+        else:
+            remaining = v0*u*rampTime+(peak-v0)/2*rampTime*u**2
+        down = rampDistance-remaining
+    else:
+        down = np.zeros_like(t)
+    distance = np.where(t <= rampTime,ramp,rampDistance+cruise+np.where(t >= rampTime+cruiseTime,down,0))
+    return np.interp(np.arange(steps),distance,t)
+
+
+def followSchedule(times,step,spin=0.002):
+    """calls step at each of the given times, as measured from the first call
+
+    Args:
+        times (float_array(n,)): time in s of each call, from stepTimes
+        step (Callable[[], None]): takes one step
+        spin (float, optional): waits shorter than this are busy-waited,
+            since sleep can overshoot by about a millisecond. Defaults to 0.002.
+
+    Returns:
+        float: the largest delay in s of a step behind its scheduled time
+    """
+    start = time.perf_counter()
+    late = 0
+    for t in times:
+        delay = start+t-time.perf_counter()
+        if delay > spin:
+            time.sleep(delay-spin)
+        while time.perf_counter() < start+t:
+            pass
+        late = max(late,time.perf_counter()-start-t)
+        step()
+    return late
@@ -0,0 +1,52 @@
+#PROGRESS
+
+import time
+
+class Progress:
+    """console output for the measurements of a run. Printing a formatted line
+       per measurement is a noticeable part of the loop time on the Pi
+       (especially over SSH), so by default only one line per interval seconds
+       or every rows measurements is shown
+    """
+
+    QUIET = 0
+    THROTTLED = 1
+    EVERY_ROW = 2
+
+    def __init__(self,verbosity=1,every=None,interval=1):
+        """
+        Args:
+            verbosity (int, optional): Progress.QUIET (0) prints nothing,
+                Progress.THROTTLED (1) prints at most one line per interval or
+                per every rows, Progress.EVERY_ROW (2) prints every
+                measurement. Defaults to 1.
+            every (int, optional): print every this many rows when throttled.
+                Defaults to None (only use interval).
+            interval (float, optional): seconds between lines when throttled.
+                Defaults to 1.
+        """
+        self.verbosity = verbosity
+        self.every = every
+        self.interval = interval
+        self.rows = 0
+        self.lastRows = 0
+        # so the first measurement is always shown
+        self.last = time.monotonic()-interval
+
+    def show(self,message,*args):
+        """counts one measurement and prints it if due. The message is only
+           formatted when it is printed
+
+        Args:
+            message (string): format string for the measurement
+            *args: values for message
+        """
+        self.rows += 1
+        if self.verbosity >= self.EVERY_ROW:
+            print(message.format(*args))
+        elif self.verbosity == self.THROTTLED:
+            now = time.monotonic()
+            if now-self.last >= self.interval or (self.every and self.rows-self.lastRows >= self.every):
+                print('[{} rows] '.format(self.rows)+message.format(*args))
+                self.last = now
+                self.lastRows = self.rows
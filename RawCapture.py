@@ -0,0 +1,83 @@
+#RAW CAPTURE
+
+import struct
+import numpy as np
+
+from Fluxgate import AIN_KEYS, ScanAssembler
+
+class RawCapture:
+    """appends every stream scan of all six AINs to a .npy file in fixed size
+       chunks, so full rate runs can be kept without growing RAM. The file can
+       be opened at any point with np.load(filename, mmap_mode='r')
+    """
+
+    # one record per scan: scan index, device time since stream start and the
+    # six AINs in the order x1,y1,z1,x2,y2,z2
+    DTYPE = np.dtype([('scan','<i8'),('time','<f8'),('ain','<f4',(len(AIN_KEYS),))])
+    # fixed header size so the shape can be rewritten in place after each chunk
+    HEADER_LEN = 256
+
+    def __init__(self,filename,scanFreq,chunk=8192):
+        """
+        Args:
+            filename (string): path of the .npy file to write
+            scanFreq (int): the stream scan frequency, used to turn scan indices
+                into device time
+            chunk (int, optional): number of scans buffered in memory before
+                being written to disk. Defaults to 8192.
+        """
+        self.filename = filename
+        self.scanFreq = scanFreq
+        self.buffer = np.zeros(chunk,self.DTYPE)
+        self.fill = 0
+        self.written = 0
+        self.assembler = ScanAssembler()
+        self.file = open(filename,'wb')
+        self.writeHeader()
+
+    def writeHeader(self):
+        """writes (or rewrites) the .npy header for the scans written so far
+        """
+        d = {'descr':np.lib.format.dtype_to_descr(self.DTYPE),'fortran_order':False,'shape':(self.written,)}
+        # magic string, version 1.0, header length, then the padded dict
+        header = repr(d).ljust(self.HEADER_LEN-10-1)+'\n'
+        self.file.seek(0)
+        self.file.write(b'\x93NUMPY\x01\x00'+struct.pack('<H',len(header))+header.encode('latin1'))
+        self.file.seek(0,2)
+
+    def append(self,r):
+        """appends the scans of one stream result
+
+        Args:
+            r (dict): a result yielded by labjack.streamData()
+        """
+        scans,data = self.assembler.add(r)
+        n = len(scans)
+        start = 0
+        while start < n:
+            m = min(n-start,len(self.buffer)-self.fill)
+            block = self.buffer[self.fill:self.fill+m]
+            block['scan'] = scans[start:start+m]
+            block['time'] = scans[start:start+m]/self.scanFreq
+            block['ain'] = data[start:start+m]
+            self.fill += m
+            start += m
+            if self.fill == len(self.buffer):
+                self.flush()
+
+    def flush(self):
+        """writes the buffered scans to disk and updates the header
+        """
+        if self.fill:
+            self.file.write(self.buffer[:self.fill].tobytes())
+            self.written += self.fill
+            self.fill = 0
+            self.writeHeader()
+            self.file.flush()
+
+    def close(self):
+        """flushes the remaining scans and closes the file
+        """
+        self.flush()
+        self.file.close()
+        print('{} raw scans saved to {}'.format(self.written,self.filename))
@@ -0,0 +1,104 @@
+#REPEAT AVERAGE
+
+"""
+Running average of repeated posRuns, updated one measurement at a time.
+
+Measurements are binned onto the motor's step grid and kept separately for
+passes with increasing and decreasing position, since backlash shifts the two
+directions relative to each other. The mean and its uncertainty for every bin
+are updated in place (Welford's algorithm), so a long repeat session always
+has a current profile without reloading the earlier runs.
+"""
+
+import csv
+import numpy as np
+
+from RunLoader import AXES, ERRORS
+
+
+class RepeatAggregator:
+    """the per direction running mean of x1..z2 at every step position
+    """
+
+    INCREASING = 0
+    DECREASING = 1
+    DIRECTIONS = ['increasing','decreasing']
+
+    def __init__(self,start,stop,step,margin=2):
+        """
+        Args:
+            start (float): one end of the scanned range in cm
+            stop (float): the other end in cm
+            step (float): distance between measurements in cm, usually
+                Gradiometer.CM_PER_STEP
+            margin (int, optional): extra bins beyond each end, for passes that
+                overshoot the range. Defaults to 2.
+        """
+        self.step = step
+        self.first = int(np.floor(min(start,stop)/step))-margin
+        bins = int(np.ceil(max(start,stop)/step))+margin-self.first+1
+        self.n = np.zeros((2,bins),dtype=int)
+        self.mean = np.zeros((2,bins,len(AXES)))
+        # sum of squared differences from the mean, for the spread of repeats
+        self.m2 = np.zeros((2,bins,len(AXES)))
+        # the last measurement's own uncertainty, used while there is one repeat
+        self.err = np.full((2,bins,len(AXES)),np.nan)
+
+    def add(self,position,direction,values,errors):
+        """adds one measurement
+
+        Args:
+            position (float): position of the measurement in cm
+            direction (int): INCREASING or DECREASING, the direction of the pass
+            values (List[float]): x1, y1, z1, x2, y2, z2
+            errors (List[float]): their uncertainties
+
+        Returns:
+            bool: False if position is outside the range, the measurement is
+                then ignored
+        """
+        i = int(round(position/self.step))-self.first
+        if not 0 <= i < self.n.shape[1]:
+            return False
+        values = np.asarray(values,dtype=float)
+        self.n[direction,i] += 1
+        delta = values-self.mean[direction,i]
+        self.mean[direction,i] += delta/self.n[direction,i]
+        self.m2[direction,i] += delta*(values-self.mean[direction,i])
+        self.err[direction,i] = errors
+        return True
+
+    def profile(self,direction):
+        """the current average profile of one direction
+
+        Args:
+            direction (int): INCREASING or DECREASING
+
+        Returns:
+            tuple (ndarray, ndarray, ndarray, ndarray): the positions (m,) with
+                at least one measurement, the mean (m,6), its uncertainty
+                (m,6), and the number of repeats (m,). With two or more
+                repeats the uncertainty is the standard error of the repeats,
+                with one it is that measurement's own uncertainty
+        """
+        n = self.n[direction]
+        have = n > 0
+        count = n[have][:,None]
+        spread = np.sqrt(self.m2[direction][have]/np.maximum(count-1,1)/count)
+        sem = np.where(count > 1,spread,self.err[direction][have])
+        position = (np.flatnonzero(have)+self.first)*self.step
+        return position,self.mean[direction][have],sem,n[have]
+
+    def save(self,filename):
+        """saves both directions' profiles to a .csv
+
+        Args:
+            filename (string): path of the .csv
+        """
+        with open(filename,'w',newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['position','direction','n']+AXES+ERRORS)
+            for direction in [self.INCREASING,self.DECREASING]:
+                position,mean,sem,n = self.profile(direction)
+                for row in zip(position,n,mean.tolist(),sem.tolist()):
+                    writer.writerow([row[0],self.DIRECTIONS[direction],row[1]]+row[2]+row[3])
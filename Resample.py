@@ -0,0 +1,120 @@
+#RESAMPLE
+
+"""
+Maps the six fluxgate channels of a posRun onto one shared position grid.
+
+The x and z sensing points of each fluxgate sit 3 cm and 1.5 cm below the y
+sensing point, which is where the run's position column is measured, so each
+axis is sampled on its own shifted grid. resample interpolates every channel
+onto the same grid (in the position of the y sensing point) and marks where a
+channel actually has data, after which runs can be compared or subtracted as
+plain (n,6) arrays:
+
+    grid,values,errors,mask = loadResampled('Run_Data/...-foil4-par-short.csv',step=0.1)
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from RunLoader import loadRun, cachePath, saveCache, CACHE, AXES, ERRORS
+from Geometry import OFFSETS
+
+
+def gridFor(position,step=None):
+    """
+    Args:
+        position (ndarray): the positions of a run
+        step (float, optional): grid spacing in cm. Defaults to None, the
+            run's own median step.
+
+    Returns:
+        ndarray: an evenly spaced grid covering every channel of the run
+    """
+    position = np.unique(position[np.isfinite(position)])
+    if len(position) < 2:
+        raise ValueError('the run stays at one position')
+    if step is None:
+        step = float(np.median(np.diff(position)))
+    lo = position[0]+OFFSETS.min()
+    hi = position[-1]+OFFSETS.max()
+    return lo+step*np.arange(int(np.floor((hi-lo)/step+1e-9))+1)
+
+
+def resample(data,grid=None,step=None,maxGap=None):
+    """interpolates all six channels of a run onto one position grid
+
+    Args:
+        data (structured array): the run as loaded by RunLoader.loadRun
+        grid (ndarray, optional): the shared positions in cm. Defaults to None,
+            gridFor(data['position'],step).
+        step (float, optional): spacing of the default grid. Defaults to None.
+        maxGap (float, optional): grid points further than this from a
+            measurement on both sides are not covered. Defaults to None, twice
+            the run's median step.
+
+    Returns:
+        tuple (ndarray, ndarray, ndarray, ndarray): the grid (m,), the
+            channels and their uncertainties (m,6) in the order of AXES, and
+            the coverage mask (m,6), False where a channel has no measurement
+            around the grid point. Uncovered values are NaN
+    """
+    position = np.asarray(data['position'])
+    keep = np.isfinite(position)
+    order = np.argsort(position[keep],kind='stable')
+    position = position[keep][order]
+    values = np.stack([np.asarray(data[name])[keep][order] for name in AXES],1)
+    errors = np.stack([np.asarray(data[name])[keep][order] for name in ERRORS],1)
+    if grid is None:
+        grid = gridFor(position,step)
+    grid = np.asarray(grid,dtype=float)
+    if maxGap is None:
+        diffs = np.diff(np.unique(position))
+        maxGap = 2*float(np.median(diffs)) if len(diffs) else 0
+
+    # where each grid point falls on each channel's own positions, (m,6)
+    query = grid[:,None]-OFFSETS[None,:]
+    right = np.clip(np.searchsorted(position,query),1,len(position)-1)
+    left = right-1
+    width = position[right]-position[left]
+    w = np.clip(np.divide(query-position[left],width,out=np.zeros_like(query),where=width > 0),0,1)
+    columns = np.arange(len(AXES))[None,:]
+    resampled = (1-w)*values[left,columns]+w*values[right,columns]
+    resampledErr = np.hypot((1-w)*errors[left,columns],w*errors[right,columns])
+
+    mask = ((query >= position[0]) & (query <= position[-1]) & (width <= maxGap)
+            & np.isfinite(resampled))
+    resampled[~mask] = np.nan
+    resampledErr[~mask] = np.nan
+    return grid,resampled,resampledErr,mask
+
+
+def loadResampled(path,grid=None,step=None,maxGap=None,cacheDir=CACHE):
+    """loads a run resampled onto a grid, resampling only the first time for
+       each run version and grid
+
+    Args:
+        path (string): a .csv or .run run file
+        grid, step, maxGap: as for resample
+        cacheDir (string, optional): folder for the cached copies, shared with
+            RunLoader, None to not cache. Defaults to '.runcache'.
+
+    Returns:
+        tuple (ndarray, ndarray, ndarray, ndarray): as for resample
+    """
+    # loading first also clears resampled copies of older versions of the file
+    data,metadata = loadRun(path,cacheDir)
+    if cacheDir is None:
+        return resample(data,grid,step,maxGap)
+    settings = json.dumps([None if grid is None else hashlib.sha1(np.asarray(grid,dtype=float).tobytes()).hexdigest(),
+                           step,maxGap])
+    prefix,cached = cachePath(path,cacheDir)
+    cached = '{}-grid-{}.npz'.format(cached,hashlib.sha1(settings.encode()).hexdigest()[:16])
+    if os.path.exists(cached):
+        with np.load(cached) as f:
+            return f['grid'],f['values'],f['errors'],f['mask']
+
+    grid,values,errors,mask = resample(data,grid,step,maxGap)
+    saveCache(cached,grid=grid,values=values,errors=errors,mask=mask)
+    return grid,values,errors,mask
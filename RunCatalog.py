@@ -0,0 +1,218 @@
+#RUN CATALOG
+
+"""
+SQLite index of the runs in Run_Data, so runs can be found by tag, date, mode,
+position range or field statistics without opening every file. Gradiometer
+adds every new run at the end of the run; existing files are added with
+
+    python RunCatalog.py backfill
+
+and searched with e.g.
+
+    python RunCatalog.py query --tag foil6-perp --within 20 58
+"""
+
+import os
+import re
+import glob
+import sqlite3
+import argparse
+from datetime import datetime
+import numpy as np
+
+from RunLoader import loadRun
+
+CATALOG = 'Run_Data/catalog.sqlite'
+AXES = ['x1','y1','z1','x2','y2','z2']
+# gradient and common mode, see Fluxgate.fieldGradient
+GRADIENT_AXES = ['gx','gy','gz','cx','cy','cz']
+# Run_Data file names are <date>_<time>-<tag>.csv
+FILENAME = re.compile(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})-(.*)\.(csv|run)$')
+
+COLUMNS = ([('path','TEXT PRIMARY KEY'),('tag','TEXT'),('timestamp','TEXT'),('mode','TEXT'),
+            ('pos_min','REAL'),('pos_max','REAL'),('duration','REAL'),('rows','INTEGER'),
+            ('samples_per_pos','INTEGER'),('scanFreq','REAL'),('simulated','INTEGER'),('mtime','REAL')]
+           +[('{}_{}'.format(stat,axis),'REAL') for axis in AXES+GRADIENT_AXES for stat in ['mean','std','min','max']])
+
+
+def connect(catalog=CATALOG):
+    """opens the catalog, creating it if needed
+
+    Args:
+        catalog (string, optional): path of the database. Defaults to
+            Run_Data/catalog.sqlite.
+
+    Returns:
+        sqlite3.Connection: the open catalog, rows can be read by column name
+    """
+    db = sqlite3.connect(catalog)
+    db.row_factory = sqlite3.Row
+    db.execute('CREATE TABLE IF NOT EXISTS runs ({})'.format(', '.join(' '.join(c) for c in COLUMNS)))
+    # catalogs made before a column was added get it, empty for the runs already in them
+    have = {row['name'] for row in db.execute('PRAGMA table_info(runs)')}
+    for name,kind in COLUMNS:
+        if name not in have:
+            db.execute('ALTER TABLE runs ADD COLUMN {} {}'.format(name,kind))
+    for column in ['tag','timestamp','mode']:
+        db.execute('CREATE INDEX IF NOT EXISTS runs_{0} ON runs ({0})'.format(column))
+    return db
+
+
+def loadRunColumns(path):
+    """loads the numeric columns of a run file (see RunLoader.loadRun)
+
+    Args:
+        path (string): a .csv or .run file from Run_Data
+
+    Returns:
+        tuple (dict, dict): the metadata and the columns by name as float
+            arrays
+    """
+    data,metadata = loadRun(path)
+    return metadata,{name:np.asarray(data[name]) for name in data.dtype.names if name != 'timestamp'}
+
+
+def addRun(path,metadata=None,catalog=CATALOG):
+    """adds or updates one run in the catalog
+
+    Args:
+        path (string): a .csv or .run file from Run_Data
+        metadata (dict, optional): run settings, e.g. mode, samples_per_pos and
+            scanFreq as known by the run. Defaults to None, which uses what the
+            file holds and guesses the rest.
+        catalog (string, optional): path of the database. Defaults to
+            Run_Data/catalog.sqlite.
+    """
+    fileMetadata,columns = loadRunColumns(path)
+    metadata = dict(fileMetadata,**(metadata or {}))
+    match = FILENAME.search(os.path.basename(path))
+    entry = {'path':os.path.normpath(path),'mtime':os.path.getmtime(path),
+             'tag':metadata.get('tag',match.group(2) if match else None),
+             'timestamp':datetime.strptime(match.group(1),'%Y-%m-%d_%H-%M-%S').isoformat(sep=' ') if match else None,
+             'samples_per_pos':metadata.get('samples_per_pos'),'scanFreq':metadata.get('scanFreq'),
+             'simulated':metadata.get('simulated'),'rows':len(columns['time'])}
+    position = columns['position']
+    position = position[np.isfinite(position)]
+    if len(position):
+        entry['pos_min'] = float(position.min())
+        entry['pos_max'] = float(position.max())
+    # time runs stay at one position
+    entry['mode'] = metadata.get('mode',('timeRun' if len(position) and entry['pos_min'] == entry['pos_max'] else 'posRun'))
+    time = columns['time'][np.isfinite(columns['time'])]
+    if len(time):
+        entry['duration'] = float(time.max()-time.min())
+    for axis in AXES+GRADIENT_AXES:
+        values = columns[axis][np.isfinite(columns[axis])]
+        if len(values):
+            entry['mean_'+axis] = float(values.mean())
+            entry['std_'+axis] = float(values.std())
+            entry['min_'+axis] = float(values.min())
+            entry['max_'+axis] = float(values.max())
+    db = connect(catalog)
+    with db:
+        db.execute('INSERT OR REPLACE INTO runs ({}) VALUES ({})'.format(', '.join(entry),', '.join('?'*len(entry))),list(entry.values()))
+    db.close()
+
+
+def backfill(directory='Run_Data',catalog=CATALOG):
+    """adds every run file in directory that is new or changed since it was
+       last added
+
+    Args:
+        directory (string, optional): folder of run files. Defaults to
+            'Run_Data'.
+        catalog (string, optional): path of the database. Defaults to
+            Run_Data/catalog.sqlite.
+
+    Returns:
+        int: number of runs added or updated
+    """
+    db = connect(catalog)
+    known = {row['path']:row['mtime'] for row in db.execute('SELECT path, mtime FROM runs')}
+    db.close()
+    added = 0
+    for path in sorted(glob.glob(os.path.join(directory,'*.csv'))+glob.glob(os.path.join(directory,'*.run'))):
+        path = os.path.normpath(path)
+        # timing summaries, background subtracted copies and .csv exports of .run files (see run_to_csv.py) aren't runs
+        if path.endswith(('-timing.csv','-bgsub.csv','-average.csv')) or not FILENAME.search(os.path.basename(path)):
+            continue
+        if path.endswith('.csv') and os.path.exists(path[:-len('.csv')]+'.run'):
+            continue
+        if known.get(path) == os.path.getmtime(path):
+            continue
+        try:
+            addRun(path,catalog=catalog)
+            added += 1
+        except Exception as e:
+            print('could not add {}: {}'.format(path,e))
+    return added
+
+
+def findRuns(tag=None,mode=None,within=None,covering=None,after=None,before=None,catalog=CATALOG):
+    """searches the catalog
+
+    Args:
+        tag (string, optional): only runs whose tag contains this. Defaults to
+            None.
+        mode (string, optional): 'posRun', 'timeRun'... Defaults to None.
+        within (tuple (float, float), optional): only runs whose positions all
+            lie within this range in cm. Defaults to None.
+        covering (tuple (float, float), optional): only runs that measured at
+            least this range in cm. Defaults to None.
+        after (string, optional): only runs started at or after this date,
+            e.g. '2020-03-25'. Defaults to None.
+        before (string, optional): only runs started before this date.
+            Defaults to None.
+        catalog (string, optional): path of the database. Defaults to
+            Run_Data/catalog.sqlite.
+
+    Returns:
+        list of sqlite3.Row: the matching runs, oldest first
+    """
+    where = []
+    args = []
+    if tag:
+        where.append('tag LIKE ?')
+        args.append('%{}%'.format(tag))
+    if mode:
+        where.append('mode = ?')
+        args.append(mode)
+    if within:
+        where.append('pos_min >= ? AND pos_max <= ?')
+        args += list(within)
+    if covering:
+        where.append('pos_min <= ? AND pos_max >= ?')
+        args += list(covering)
+    if after:
+        where.append('timestamp >= ?')
+        args.append(after)
+    if before:
+        where.append('timestamp < ?')
+        args.append(before)
+    db = connect(catalog)
+    rows = db.execute('SELECT * FROM runs{} ORDER BY timestamp'.format(' WHERE '+' AND '.join(where) if where else ''),args).fetchall()
+    db.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='index and search the runs in Run_Data')
+    sub = parser.add_subparsers(dest='command',required=True)
+    sub.add_parser('backfill',help='add all existing run files')
+    query = sub.add_parser('query',help='search the catalog')
+    query.add_argument('--tag')
+    query.add_argument('--mode')
+    query.add_argument('--within',nargs=2,type=float)
+    query.add_argument('--covering',nargs=2,type=float)
+    query.add_argument('--after')
+    query.add_argument('--before')
+    args = parser.parse_args()
+
+    if args.command == 'backfill':
+        print('{} runs added'.format(backfill()))
+    else:
+        for row in findRuns(args.tag,args.mode,args.within,args.covering,args.after,args.before):
+            print('{}  {:8} {:6.2f}-{:6.2f}cm {:6d} rows  {}'.format(row['timestamp'],row['mode'],row['pos_min'] or 0,row['pos_max'] or 0,row['rows'],row['path']))
+
+if __name__ == '__main__':
+    main()
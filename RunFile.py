@@ -0,0 +1,270 @@
+#RUN FILE
+
+"""
+Writers for run data. CsvRunWriter is the original row by row .csv format,
+RunFileWriter a chunked columnar binary format (.run):
+
+    b'GRADRUN\\x01'
+    records of: 1 byte type, uint32 payload length, payload
+        b'M' metadata as json (tag, start/stop, samples_per_pos, scanFreq,
+             CM_PER_STEP, column dtypes...), later ones update earlier ones
+        b'C' a chunk of rows: uint32 row count, then each column's values as
+             a contiguous little endian array, in the order of 'columns'
+
+Timestamps are stored as int64 ns since the epoch, 'time' as float64 and
+measured values as float32. readRun loads a .run file and runToCsv converts it
+back to the .csv columns.
+"""
+
+import csv
+import json
+import struct
+import time
+from datetime import datetime
+import numpy as np
+
+MAGIC = b'GRADRUN\x01'
+
+# column dtypes, anything not listed is float32
+DTYPES = {'timestamp':'<i8','time':'<f8','position':'<f8','n':'<i8','pass':'<i8'}
+
+def columnDtype(name):
+    return np.dtype(DTYPES.get(name,'<f4'))
+
+
+class CsvRunWriter:
+    """writes rows to a .csv with csv.DictWriter, the original run format.
+       Rows are batched and written together once chunk rows are waiting or
+       flushSeconds have passed since the last write
+    """
+
+    extension = '.csv'
+
+    def __init__(self,filename,fieldnames,metadata=None,chunk=256,flushSeconds=1,derive=None):
+        """
+        Args:
+            filename (string): path of the .csv
+            fieldnames (List[string]): the columns
+            metadata (dict, optional): not saved in a .csv. Defaults to None.
+            chunk (int, optional): rows batched before being written. Defaults
+                to 256.
+            flushSeconds (float, optional): longest time rows wait before being
+                written. Defaults to 1.
+            derive (Callable[[Callable[[string], ndarray]], dict], optional):
+                fills in derived columns for a whole batch of rows before it is
+                written, given a function returning a column's values by name
+                (e.g. Fluxgate.gradientColumns). Defaults to None.
+        """
+        self.filename = filename
+        self.derive = derive
+        self.chunk = chunk
+        self.flushSeconds = flushSeconds
+        self.rows = []
+        self.lastFlush = time.monotonic()
+        self.file = open(filename,'w')
+        self.writer = csv.DictWriter(self.file,fieldnames)
+        self.writer.writeheader()
+
+    def writerow(self,row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk or time.monotonic()-self.lastFlush >= self.flushSeconds:
+            self.flush()
+
+    def update(self,metadata):
+        pass
+
+    def flush(self):
+        """writes the batched rows
+        """
+        if self.derive and self.rows:
+            rows = self.rows
+            derived = self.derive(lambda name: np.array([row[name] for row in rows],dtype=float))
+            for name,values in derived.items():
+                for row,value in zip(rows,values.tolist()):
+                    row[name] = value
+        self.writer.writerows(self.rows)
+        self.rows = []
+        self.file.flush()
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class RunFileWriter:
+    """writes rows to a chunked columnar .run file, with the same writerow
+       interface as CsvRunWriter
+    """
+
+    extension = '.run'
+
+    def __init__(self,filename,fieldnames,metadata=None,chunk=1024,flushSeconds=1,derive=None):
+        """
+        Args:
+            filename (string): path of the .run file
+            fieldnames (List[string]): the columns
+            metadata (dict, optional): run settings saved in the header, e.g.
+                tag, start, stop, samples_per_pos, scanFreq. Defaults to None.
+            chunk (int, optional): rows buffered before a chunk is written.
+                Defaults to 1024.
+            flushSeconds (float, optional): longest time rows wait before being
+                written. Defaults to 1.
+            derive (Callable[[Callable[[string], ndarray]], dict], optional):
+                as for CsvRunWriter. Defaults to None.
+        """
+        self.filename = filename
+        self.derive = derive
+        self.fieldnames = list(fieldnames)
+        self.chunk = chunk
+        self.flushSeconds = flushSeconds
+        self.lastFlush = time.monotonic()
+        self.columns = {name:np.zeros(chunk,columnDtype(name)) for name in self.fieldnames}
+        self.fill = 0
+        self.rows = 0
+        self.file = open(filename,'wb')
+        self.file.write(MAGIC)
+        metadata = dict(metadata or {})
+        metadata['columns'] = [[name,columnDtype(name).str] for name in self.fieldnames]
+        self.update(metadata)
+
+    def writeRecord(self,kind,payload):
+        self.file.write(kind+struct.pack('<I',len(payload))+payload)
+
+    def update(self,metadata):
+        """adds to or overrides the saved metadata, e.g. the stop time at the
+           end of a run
+
+        Args:
+            metadata (dict): json serializable settings
+        """
+        self.writeRecord(b'M',json.dumps(metadata,default=str).encode())
+
+    def writerow(self,row):
+        """buffers one row, missing columns are left as 0
+
+        Args:
+            row (dict): values by column name, the timestamp as a datetime
+        """
+        for name,value in row.items():
+            if name == 'timestamp':
+                value = int(value.timestamp()*1e9)
+            self.columns[name][self.fill] = value
+        self.fill += 1
+        if self.fill == self.chunk or time.monotonic()-self.lastFlush >= self.flushSeconds:
+            self.flush()
+
+    def flush(self):
+        """writes the buffered rows as one chunk
+        """
+        if self.fill:
+            if self.derive:
+                derived = self.derive(lambda name: self.columns[name][:self.fill])
+                for name,values in derived.items():
+                    self.columns[name][:self.fill] = values
+            payload = [struct.pack('<I',self.fill)]
+            payload += [self.columns[name][:self.fill].tobytes() for name in self.fieldnames]
+            self.writeRecord(b'C',b''.join(payload))
+            self.rows += self.fill
+            # the buffers are reused, clear them so a column missing from a later row is 0 again
+            for column in self.columns.values():
+                column[:self.fill] = 0
+            self.fill = 0
+            self.file.flush()
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.update({'rows':self.rows,'stopTime':datetime.now()})
+        self.file.close()
+
+
+def runWriter(filename,fieldnames,metadata=None,fmt='csv',derive=None):
+    """opens a writer for a run
+
+    Args:
+        filename (string): path of the run file without the extension
+        fieldnames (List[string]): the columns
+        metadata (dict, optional): run settings, only saved by the .run format.
+            Defaults to None.
+        fmt (string, optional): 'csv' for CsvRunWriter or 'run' for
+            RunFileWriter. Defaults to 'csv'.
+        derive (Callable, optional): computes derived columns for each batch
+            of rows, see CsvRunWriter. Defaults to None.
+
+    Returns:
+        CsvRunWriter or RunFileWriter: the writer, its filename attribute has
+            the extension added
+    """
+    writer = {'csv':CsvRunWriter,'run':RunFileWriter}[fmt]
+    return writer(filename+writer.extension,fieldnames,metadata,derive=derive)
+
+
+def readRun(filename):
+    """loads a .run file
+
+    Args:
+        filename (string): path of the .run file
+
+    Returns:
+        tuple (dict, structured array): the metadata, and the rows with one
+            field per column
+    """
+    with open(filename,'rb') as f:
+        buf = f.read()
+    if buf[:len(MAGIC)] != MAGIC:
+        raise ValueError('{} is not a .run file'.format(filename))
+    metadata = {}
+    chunks = []
+    i = len(MAGIC)
+    # a record cut short by a crash is ignored
+    while i+5 <= len(buf):
+        kind = buf[i:i+1]
+        length, = struct.unpack('<I',buf[i+1:i+5])
+        payload = buf[i+5:i+5+length]
+        if len(payload) < length:
+            break
+        i += 5+length
+        if kind == b'M':
+            metadata.update(json.loads(payload))
+        elif kind == b'C':
+            chunks.append(payload)
+    dtype = np.dtype([(name,dt) for name,dt in metadata['columns']])
+    rows = sum(struct.unpack('<I',c[:4])[0] for c in chunks)
+    data = np.zeros(rows,dtype)
+    start = 0
+    for c in chunks:
+        n, = struct.unpack('<I',c[:4])
+        offset = 4
+        for name in dtype.names:
+            size = n*dtype[name].itemsize
+            data[name][start:start+n] = np.frombuffer(c,dtype[name],n,offset)
+            offset += size
+        start += n
+    return metadata,data
+
+
+def runToCsv(filename,csvname=None):
+    """converts a .run file to a .csv with the same columns
+
+    Args:
+        filename (string): path of the .run file
+        csvname (string, optional): path of the .csv. Defaults to None, which
+            uses the .run path with a .csv extension.
+
+    Returns:
+        string: path of the .csv
+    """
+    metadata,data = readRun(filename)
+    if csvname is None:
+        csvname = filename[:-len('.run')]+'.csv'
+    with open(csvname,'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(data.dtype.names)
+        for row in data.tolist():
+            row = list(row)
+            if 'timestamp' in data.dtype.names:
+                i = data.dtype.names.index('timestamp')
+                row[i] = datetime.fromtimestamp(row[i]/1e9)
+            writer.writerow(row)
+    return csvname
@@ -0,0 +1,164 @@
+#RUN LOADER
+
+"""
+Loads any run file into one uniform structured array:
+
+    Run_Data .csv files, with or without the dx..dz2 columns
+    .run files written by RunFile
+    csv/ files saved by LiveReadGUI, with # comment headers and
+        Bx (μ T)... columns
+
+The parsed array is cached as a .npy (keyed on the file's path, size and
+modification time, and on DTYPE) in .runcache/, so loading the same file again
+is a memory mapped read. Columns a file doesn't have are NaN, e.g. the gradient
+columns gx..dcz of runs taken before they were added.
+"""
+
+import os
+import csv
+import json
+import hashlib
+import numpy as np
+
+from RunFile import readRun
+from Fluxgate import GRADIENT_FIELDS
+
+CACHE = '.runcache'
+AXES = ['x1','y1','z1','x2','y2','z2']
+ERRORS = ['dx1','dy1','dz1','dx2','dy2','dz2']
+DTYPE = np.dtype([('timestamp','datetime64[us]'),('time','<f8'),('position','<f8')]
+                 +[(name,'<f8') for name in AXES+ERRORS+GRADIENT_FIELDS])
+# part of every cache file name, so copies cached with other fields are parsed again
+DTYPE_KEY = hashlib.sha1(str(DTYPE.descr).encode()).hexdigest()[:8]
+
+# LiveReadGUI column names
+ALIASES = {'Time':'timestamp','Distance (cm)':'position',
+           'Bx (μ T)':'x1','By (μ T)':'y1','Bz (μ T)':'z1',
+           'Bx-2 (μ T)':'x2','By-2 (μ T)':'y2','Bz-2 (μ T)':'z2'}
+
+
+def parseCsv(path):
+    """parses a Run_Data or LiveReadGUI .csv
+
+    Args:
+        path (string): the .csv
+
+    Returns:
+        tuple (structured array, dict): the rows in DTYPE, and the metadata:
+            the '#' header lines under 'comments' and the field 'units' ('V'
+            for Run_Data files, 'uT' for LiveReadGUI files)
+    """
+    comments = []
+    with open(path,newline='',encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = None
+        rows = []
+        for line in reader:
+            if header is None:
+                if line and line[0].startswith('#'):
+                    comments.append(','.join(line))
+                    continue
+                header = line
+                continue
+            # rows cut short by a stopped run are skipped
+            if len(line) == len(header):
+                rows.append(line)
+    if header is None:
+        raise ValueError('{} has no data'.format(path))
+    names = [ALIASES.get(name,name) for name in header]
+    data = np.full(len(rows),np.nan,DTYPE)
+    data['timestamp'] = np.datetime64('NaT')
+    columns = list(zip(*rows)) if rows else [()]*len(names)
+    for name,column in zip(names,columns):
+        if name == 'timestamp':
+            data['timestamp'] = np.array(column,dtype='datetime64[us]')
+        elif name in DTYPE.names:
+            data[name] = np.array(column,dtype=float)
+    if 'time' not in names and len(data):
+        # LiveReadGUI only saves the timestamp
+        data['time'] = (data['timestamp']-data['timestamp'][0])/np.timedelta64(1,'s')
+    liveRead = any(name in ALIASES for name in header)
+    return data,{'comments':comments,'units':'uT' if liveRead else 'V'}
+
+
+def parseRun(path):
+    """parses a .run file
+
+    Args:
+        path (string): the .run file
+
+    Returns:
+        tuple (structured array, dict): the rows in DTYPE and the .run metadata
+    """
+    metadata,run = readRun(path)
+    data = np.full(len(run),np.nan,DTYPE)
+    for name in run.dtype.names:
+        if name == 'timestamp':
+            data['timestamp'] = run['timestamp'].astype('datetime64[ns]').astype('datetime64[us]')
+        elif name in DTYPE.names:
+            data[name] = run[name]
+    metadata['units'] = 'V'
+    return data,metadata
+
+
+def cachePath(path,cacheDir=CACHE):
+    """
+    Returns:
+        tuple (string, string): the cache file prefix for path (shared by all
+            versions of the file) and the full cache file name for its
+            current size, modification time and DTYPE, without extension
+    """
+    stat = os.stat(path)
+    prefix = os.path.join(cacheDir,hashlib.sha1(os.path.abspath(path).encode()).hexdigest())
+    return prefix,'{}-{}-{}-{}'.format(prefix,stat.st_size,stat.st_mtime_ns,DTYPE_KEY)
+
+
+def saveCache(filename,data=None,**arrays):
+    """saves a cache file under a temporary name and then renames it, so a
+       half written cache is never loaded
+
+    Args:
+        filename (string): the .npy or .npz file
+        data (ndarray, optional): the array of a .npy. Defaults to None.
+        **arrays: the named arrays of a .npz
+    """
+    root,extension = os.path.splitext(filename)
+    temporary = root+'.tmp'+extension
+    if extension == '.npz':
+        np.savez(temporary,**arrays)
+    else:
+        np.save(temporary,data)
+    os.replace(temporary,filename)
+
+
+def loadRun(path,cacheDir=CACHE):
+    """loads a run file of any format, parsing it only the first time
+
+    Args:
+        path (string): a .csv or .run run file
+        cacheDir (string, optional): folder for the cached copies, None to
+            not cache. Defaults to '.runcache'.
+
+    Returns:
+        tuple (structured array, dict): the rows with the fields timestamp,
+            time, position, x1..z2, dx1..dz2 and gx..dcz (memory mapped when
+            loaded from the cache), and the file's metadata
+    """
+    if cacheDir is None:
+        return parseRun(path) if path.endswith('.run') else parseCsv(path)
+    prefix,cached = cachePath(path,cacheDir)
+    if os.path.exists(cached+'.npy'):
+        with open(cached+'.json') as f:
+            metadata = json.load(f)
+        return np.load(cached+'.npy',mmap_mode='r'),metadata
+
+    data,metadata = parseRun(path) if path.endswith('.run') else parseCsv(path)
+    os.makedirs(cacheDir,exist_ok=True)
+    # drop copies of older versions of the file
+    for old in os.listdir(cacheDir):
+        if os.path.join(cacheDir,old).startswith(prefix+'-'):
+            os.remove(os.path.join(cacheDir,old))
+    with open(cached+'.json','w') as f:
+        json.dump(metadata,f,default=str)
+    saveCache(cached+'.npy',data)
+    return data,metadata
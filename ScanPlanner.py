@@ -0,0 +1,48 @@
+#SCAN PLANNER
+
+import numpy as np
+
+def refineSegments(position,values,gradient=0.01,curvature=0.005):
+    """finds the parts of a coarse position scan that need to be measured again
+       at full step resolution, i.e. where the field changes quickly between
+       coarse points (foils, shield ends)
+
+    Args:
+        position (float_array(n,)): coarse positions in cm, sorted
+        values (float_array(n,6)): measured x1,y1,z1,x2,y2,z2 at each position
+        gradient (float, optional): an interval is refined if any channel
+            changes by more than this many V/cm across it. Defaults to 0.01.
+        curvature (float, optional): the intervals either side of a coarse
+            point are refined if the second difference of any channel there is
+            more than this many V/cm^2. None turns this check off. Defaults
+            to 0.005.
+
+    Returns:
+        list of (float, float): (start, stop) in cm of each segment to refine,
+            neighbouring intervals merged together
+    """
+    position = np.asarray(position)
+    values = np.asarray(values)
+    if len(position) < 2:
+        return []
+    dx = np.diff(position)
+    # one flag per interval between coarse points
+    refine = np.max(np.abs(np.diff(values,axis=0))/dx[:,None],1) > gradient
+    if curvature is not None and len(position) > 2:
+        h = dx.mean()
+        curved = np.max(np.abs(values[2:]-2*values[1:-1]+values[:-2]),1)/h**2 > curvature
+        refine[:-1] |= curved
+        refine[1:] |= curved
+
+    segments = []
+    i = 0
+    while i < len(refine):
+        if refine[i]:
+            j = i
+            while j+1 < len(refine) and refine[j+1]:
+                j += 1
+            segments.append((float(position[i]),float(position[j+1])))
+            i = j+1
+        else:
+            i += 1
+    return segments
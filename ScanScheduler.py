@@ -0,0 +1,342 @@
+#SCAN SCHEDULER
+
+"""
+Runs a batch of posRuns and timeRuns described in a json recipe, e.g. the
+loop of axial_coil_routine.py and a background scan:
+
+    {"jobs": [
+        {"run": "timeRun", "tag": "axial-IOswitch-{position}", "sec": 10,
+         "positions": {"start": 0, "stop": 80, "num": 17}},
+        {"run": "posRun", "tag": "background", "start": 0, "stop": 80,
+         "reversible": true, "repeat": 2}
+    ]}
+
+Keys other than the ones below are passed on to Gradiometer.posRun/timeRun.
+    run         'posRun' or 'timeRun'
+    positions   timeRun positions in cm, a list or start/stop/num as for
+                np.linspace. A single one can be given as cm
+    tag         may contain {position} for timeRuns
+    reversible  the posRun may be taken from stop to start. Defaults to false
+    repeat      number of times to take the job. Defaults to 1
+    prompt      text to show and wait for Enter before the job, e.g. to move a
+                coil. Defaults to none
+
+Unless the recipe sets "reorder": false, the jobs are put in the order that
+needs the least carriage travel and fewest direction reversals. Jobs only move
+within a recipe entry with a prompt, or within the entries without one between
+two prompts, so no job runs before a setup change asked for ahead of it. All
+jobs run on one Gradiometer, and every finished job is recorded in
+<recipe>.progress so a stopped batch carries on where it left off. A job that
+is interrupted or fails stops the batch without being recorded:
+
+    python ScanScheduler.py coil_scan.json --plan      (order and time estimate)
+    python ScanScheduler.py coil_scan.json
+    python ScanScheduler.py coil_scan.json --simulate --speedup 20
+"""
+
+import os
+import json
+import atexit
+import hashlib
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+
+from Gradiometer import Gradiometer
+from MotionProfile import stepTimes
+import RunCatalog
+
+# recipe keys that aren't Gradiometer arguments
+SCHEDULING_KEYS = ['run','positions','reversible','repeat','prompt']
+# cost in cm of travel of one direction reversal (backlash take-up, settling)
+REVERSAL_CM = 5
+# seconds per posRun position when the catalog has no posRuns to go by
+SECONDS_PER_POSITION = 0.2
+# timeRun set up (stream configuration, first packets) in seconds
+TIMERUN_OVERHEAD = 1
+# seconds per step of a goTo without a motion profile, the motor's 30 RPM at 200 steps per turn
+UNPROFILED_STEP_SECONDS = 60/(200*30)
+
+
+def expandJobs(recipe):
+    """turns a recipe into one job per run
+
+    Args:
+        recipe (dict): the parsed recipe
+
+    Returns:
+        List[dict]: jobs with the keys 'id' (stable across runs of the same
+            recipe), 'run', 'kwargs' (for the Gradiometer method), 'enter' and
+            'exit' (positions in cm), 'direction' (1 or -1 for posRuns, 0 for
+            timeRuns), 'reversible', 'prompt' and 'entry' (index of the
+            recipe entry)
+    """
+    jobs = []
+    for i,spec in enumerate(recipe['jobs']):
+        kwargs = {key:value for key,value in spec.items() if key not in SCHEDULING_KEYS}
+        if spec['run'] == 'timeRun':
+            positions = spec.get('positions',[kwargs.pop('cm')] if 'cm' in kwargs else None)
+            if positions is None:
+                raise ValueError('job {}: a timeRun needs positions or cm'.format(i))
+            if isinstance(positions,dict):
+                positions = np.linspace(positions['start'],positions['stop'],positions['num']).tolist()
+        for r in range(spec.get('repeat',1)):
+            if spec['run'] == 'posRun':
+                jobs.append({'id':'{}.{}'.format(i,r),'run':'posRun','kwargs':kwargs,
+                             'enter':kwargs['start'],'exit':kwargs['stop'],
+                             'direction':1 if kwargs['stop'] >= kwargs['start'] else -1,
+                             'reversible':spec.get('reversible',False),'prompt':spec.get('prompt'),'entry':i})
+            elif spec['run'] == 'timeRun':
+                for k,cm in enumerate(positions):
+                    jobs.append({'id':'{}.{}.{}'.format(i,r,k),'run':'timeRun',
+                                 'kwargs':dict(kwargs,cm=cm,tag=kwargs['tag'].format(position=cm)),
+                                 'enter':cm,'exit':cm,'direction':0,
+                                 'reversible':False,'prompt':spec.get('prompt'),'entry':i})
+            else:
+                raise ValueError('job {}: unknown run {!r}'.format(i,spec['run']))
+    return jobs
+
+
+def reverse(job):
+    """
+    Returns:
+        dict: the posRun job taken from stop to start
+    """
+    kwargs = dict(job['kwargs'],start=job['kwargs']['stop'],stop=job['kwargs']['start'])
+    return dict(job,kwargs=kwargs,enter=job['exit'],exit=job['enter'],direction=-job['direction'])
+
+
+def travelCost(position,direction,job):
+    """
+    Args:
+        position (float): carriage position in cm before the job
+        direction (int): direction of the last move, 1, -1 or 0 if unknown
+        job (dict): the next job
+
+    Returns:
+        tuple (float, int): cost of moving to and doing the job in cm of
+            travel, REVERSAL_CM per reversal, and the direction after it
+    """
+    move = np.sign(job['enter']-position)
+    cost = abs(job['enter']-position)
+    if move and direction and move != direction:
+        cost += REVERSAL_CM
+    direction = move or direction
+    if job['direction']:
+        if direction and job['direction'] != direction:
+            cost += REVERSAL_CM
+        cost += abs(job['exit']-job['enter'])
+        direction = job['direction']
+    return cost,direction
+
+
+def promptGroups(jobs):
+    """splits jobs in recipe order into the groups they may be reordered in:
+       each recipe entry with a prompt on its own, since the prompt may change
+       the setup (e.g. turn a coil on), and the entries without one between them
+
+    Args:
+        jobs (List[dict]): jobs from expandJobs, in recipe order
+
+    Returns:
+        List[List[dict]]: the groups, in recipe order
+    """
+    groups = []
+    last = None
+    for job in jobs:
+        key = job['entry'] if job['prompt'] else None
+        if not groups or key != last:
+            groups.append([])
+        groups[-1].append(job)
+        last = key
+    return groups
+
+
+def orderJobs(jobs,position=0,direction=0):
+    """orders jobs to keep carriage travel and reversals low, always doing the
+       cheapest job next (reversible posRuns either way round). Jobs are only
+       moved within their group (see promptGroups)
+
+    Args:
+        jobs (List[dict]): jobs from expandJobs
+        position (float, optional): carriage position in cm at the start.
+            Defaults to 0.
+        direction (int, optional): direction of the last move. Defaults to 0.
+
+    Returns:
+        List[dict]: the jobs in order
+    """
+    ordered = []
+    for remaining in promptGroups(jobs):
+        while remaining:
+            best = None
+            for i,job in enumerate(remaining):
+                for option in [job,reverse(job)] if job['reversible'] else [job]:
+                    cost,after = travelCost(position,direction,option)
+                    if best is None or cost < best[0]:
+                        best = (cost,i,option,after)
+            cost,i,job,direction = best
+            remaining.pop(i)
+            ordered.append(job)
+            position = job['exit']
+    return ordered
+
+
+def secondsPerPosition(samples):
+    """
+    Args:
+        samples (int): samples per position
+
+    Returns:
+        float: typical seconds per posRun position, from the cataloged real
+            (not simulated) posRuns with the same samples per position if there
+            are any, all cataloged real posRuns otherwise, or
+            SECONDS_PER_POSITION
+    """
+    try:
+        runs = [row for row in RunCatalog.findRuns(mode='posRun') if row['rows'] and row['duration'] and not row['simulated']]
+    except Exception:
+        runs = []
+    same = [row for row in runs if row['samples_per_pos'] == samples]
+    runs = same or runs
+    if not runs:
+        return SECONDS_PER_POSITION
+    return float(np.median([row['duration']/row['rows'] for row in runs]))
+
+
+def estimate(jobs,position=0,g=Gradiometer):
+    """estimates how long the jobs take in the given order
+
+    Args:
+        jobs (List[dict]): ordered jobs
+        position (float, optional): carriage position in cm at the start.
+            Defaults to 0.
+        g (optional): a Gradiometer, or the class for its default speed and
+            calibration. Defaults to Gradiometer.
+
+    Returns:
+        List[float]: seconds for each job, including the move to it
+    """
+    def travel(cm):
+        steps = round(abs(cm)/g.CM_PER_STEP)
+        # a move against the approach direction may add an overshoot and backlash
+        steps += 2*g.BACKLASH_STEPS if steps else 0
+        if g.MAX_SPEED is None:
+            return steps*UNPROFILED_STEP_SECONDS
+        times = stepTimes(steps,g.MAX_SPEED/g.CM_PER_STEP,g.ACCELERATION/g.CM_PER_STEP,g.PROFILE)
+        return times[-1] if len(times) else 0
+
+    seconds = []
+    perPosition = {}
+    for job in jobs:
+        t = travel(job['enter']-position)
+        if job['run'] == 'posRun':
+            samples = job['kwargs'].get('samples_per_pos',5)
+            if samples not in perPosition:
+                perPosition[samples] = secondsPerPosition(samples)
+            positions = abs(job['exit']-job['enter'])/g.CM_PER_STEP+1
+            t += positions*perPosition[samples]
+        else:
+            # timeRun stops once more than sec whole seconds have passed
+            t += int(job['kwargs']['sec'])+1+TIMERUN_OVERHEAD
+        seconds.append(t)
+        position = job['exit']
+    return seconds
+
+
+def loadCheckpoint(filename,digest):
+    """
+    Returns:
+        dict: output file by job id of the jobs already done, empty if the
+            checkpoint is missing or belongs to a different recipe
+    """
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('recipe') != digest:
+        print('{} is for a different version of the recipe, starting over'.format(filename))
+        return {}
+    return checkpoint['done']
+
+
+def saveCheckpoint(filename,digest,done):
+    # written under a temporary name so a half written checkpoint is never loaded
+    with open(filename+'.tmp','w') as f:
+        json.dump({'recipe':digest,'done':done},f,indent=1)
+    os.replace(filename+'.tmp',filename)
+
+
+def runRecipe(recipeFile,g,plan=False,fresh=False):
+    """orders and runs the jobs of a recipe that haven't been done yet
+
+    Args:
+        recipeFile (string): path of the json recipe
+        g (Gradiometer): the gradiometer to run the jobs on, kept open
+            throughout
+        plan (bool, optional): if True, only print the order and estimated
+            times. Defaults to False.
+        fresh (bool, optional): if True, ignore the checkpoint and run every
+            job. Defaults to False.
+
+    Returns:
+        dict: output file by job id of all jobs done so far
+    """
+    with open(recipeFile) as f:
+        text = f.read()
+    recipe = json.loads(text)
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    checkpoint = recipeFile+'.progress'
+    done = {} if fresh else loadCheckpoint(checkpoint,digest)
+
+    jobs = [job for job in expandJobs(recipe) if job['id'] not in done]
+    if recipe.get('reorder',True):
+        jobs = orderJobs(jobs,g.pos,g.APPROACH)
+    seconds = estimate(jobs,g.pos,g)
+    print('{} jobs to do ({} already done), estimated {}'.format(len(jobs),len(done),timedelta(seconds=round(sum(seconds)))))
+    finish = datetime.now()
+    for job,t in zip(jobs,seconds):
+        finish += timedelta(seconds=t)
+        kwargs = job['kwargs']
+        where = '{}-{}cm'.format(kwargs['start'],kwargs['stop']) if job['run'] == 'posRun' else '{}cm'.format(kwargs['cm'])
+        print('  {:8} {:>7} {:14} {:24} ~{:6.0f}s  done by {}'.format(job['run'],job['id'],where,kwargs['tag'],t,finish.strftime('%H:%M:%S')))
+    if plan:
+        return done
+
+    for i,job in enumerate(jobs):
+        if job['prompt']:
+            input('{} and press Enter'.format(job['prompt'].format(position=job['enter'])))
+        print('job {}/{}: {} {}'.format(i+1,len(jobs),job['run'],job['kwargs']['tag']))
+        summary = getattr(g,job['run'])(**job['kwargs'])
+        if summary['interrupted']:
+            print('job {} did not finish, stopping; run the recipe again to redo it and carry on'.format(job['id']))
+            return done
+        done[job['id']] = summary['filename']
+        saveCheckpoint(checkpoint,digest,done)
+    print('all jobs done')
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recipe',help='json recipe')
+    parser.add_argument('--plan',action='store_true',help='only show the job order and time estimate')
+    parser.add_argument('--fresh',action='store_true',help='ignore the progress of earlier attempts')
+    parser.add_argument('--simulate',action='store_true',help='use the simulated labjack and motor')
+    parser.add_argument('--speedup',type=float,default=1,help='simulation speed relative to real time')
+    args = parser.parse_args()
+
+    if args.simulate:
+        from Simulation import simulatedBackend
+        g = Gradiometer(*simulatedBackend(args.speedup))
+    else:
+        g = Gradiometer()
+    atexit.register(g.motor.turnOffMotors)
+    atexit.register(g.savePos)
+    atexit.register(g.labjack.close)
+    runRecipe(args.recipe,g,args.plan,args.fresh)
+    if not args.plan:
+        g.goTo(0)
+
+if __name__ == '__main__':
+    main()
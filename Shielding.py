@@ -0,0 +1,201 @@
+#SHIELDING FACTOR
+
+"""
+Shielding factor profiles along the shield from paired runs.
+
+A shielding factor is the field a coil makes without the shield (the reference
+runs) divided by the field it makes inside the shield, at the same position.
+Either side can be one posRun or a set of stepped timeRuns, one per position,
+as taken by axial_coil_routine.py and radial_coil_routine.py. Runs with the
+coil off can be given for either side and are subtracted first. Every run is
+reduced to one row per position, all six channels are put onto one position
+grid (see Resample) and the ratio is taken for every channel and for the field
+magnitude of each fluxgate at once:
+
+    python Shielding.py --inside 'Run_Data/*radial-shield-*' --reference 'Run_Data/*radial-ref-*'
+
+Results are cached per set of runs, so re-analysing a coil campaign only reads
+files that changed.
+"""
+
+import os
+import glob
+import json
+import hashlib
+import argparse
+import numpy as np
+
+from RunLoader import loadRun, saveCache, DTYPE, AXES, ERRORS, CACHE
+from Resample import resample, gridFor
+from Geometry import SHIELDSTART, SHIELDSTOP
+
+
+def profile(paths):
+    """reduces a set of runs to one row per position
+
+    Args:
+        paths (List[string]): one posRun, or stepped timeRuns each taken at a
+            single position
+
+    Returns:
+        structured array: rows in RunLoader.DTYPE sorted by position, each
+            timeRun averaged to one row with the standard error of its mean
+    """
+    runs = [loadRun(path)[0] for path in paths]
+    if len(runs) == 1 and np.ptp(runs[0]['position']) > 0:
+        # a posRun already has one row per position
+        return np.sort(runs[0],order='position')
+    rows = np.full(len(runs),np.nan,DTYPE)
+    means = np.empty((len(runs),len(AXES)))
+    errors = np.empty((len(runs),len(AXES)))
+    for i,data in enumerate(runs):
+        values = np.stack([np.asarray(data[name]) for name in AXES],1)
+        n = np.isfinite(values).sum(0)
+        rows['position'][i] = np.median(data['position'])
+        rows['time'][i] = np.nanmean(data['time'])
+        means[i] = np.nanmean(values,0)
+        errors[i] = np.nanstd(values,0)/np.sqrt(np.maximum(n,1))
+    for j in range(len(AXES)):
+        rows[AXES[j]] = means[:,j]
+        rows[ERRORS[j]] = errors[:,j]
+    return np.sort(rows,order='position')
+
+
+def magnitude(values,errors):
+    """
+    Args:
+        values (ndarray(...,6)): x1..z2
+        errors (ndarray(...,6)): their uncertainties
+
+    Returns:
+        tuple (ndarray(...,2), ndarray(...,2)): the field magnitude of each
+            fluxgate and its uncertainty
+    """
+    values = values.reshape(values.shape[:-1]+(2,3))
+    errors = errors.reshape(errors.shape[:-1]+(2,3))
+    total = np.sqrt((values**2).sum(-1))
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return total,np.sqrt(((values*errors)**2).sum(-1))/total
+
+
+def ratio(a,da,b,db):
+    """a/b with the relative uncertainties added in quadrature"""
+    with np.errstate(invalid='ignore',divide='ignore'):
+        r = a/b
+        return r,np.abs(r)*np.hypot(da/a,db/b)
+
+
+def shieldingFactor(inside,reference,insideOff=None,referenceOff=None,grid=None,step=None):
+    """computes the shielding factor profile of every channel
+
+    Args:
+        inside (List[string]): runs inside the shield with the coil on
+        reference (List[string]): runs without the shield with the coil on
+        insideOff (List[string], optional): runs inside the shield with the
+            coil off, subtracted from inside. Defaults to None.
+        referenceOff (List[string], optional): runs without the shield with
+            the coil off, subtracted from reference. Defaults to None.
+        grid (ndarray, optional): positions in cm to compute the profile at.
+            Defaults to None, the grid of the inside runs.
+        step (float, optional): spacing of the default grid. Defaults to None,
+            the spacing of the inside runs.
+
+    Returns:
+        dict: 'position' (m,), 'sf' and 'dsf' (m,6) the shielding factor of
+            x1..z2 and its uncertainty, 'sfTotal' and 'dsfTotal' (m,2) the
+            shielding factor of each fluxgate's field magnitude, and 'mask'
+            (m,6) where every run covers the channel
+
+    Raises:
+        ValueError: if inside or reference is empty
+    """
+    for name,paths in [('inside',inside),('reference',reference)]:
+        if not paths:
+            raise ValueError('no {} runs given'.format(name))
+
+    def field(paths,offPaths):
+        grid_,values,errors,mask = resample(profile(paths),grid)
+        if offPaths:
+            grid_,off,offErrors,offMask = resample(profile(offPaths),grid)
+            values = values-off
+            errors = np.hypot(errors,offErrors)
+            mask = mask & offMask
+        return values,errors,mask
+
+    if grid is None:
+        grid = gridFor(profile(inside)['position'],step)
+    insideB,insideErr,insideMask = field(inside,insideOff)
+    referenceB,referenceErr,referenceMask = field(reference,referenceOff)
+    sf,dsf = ratio(referenceB,referenceErr,insideB,insideErr)
+    sfTotal,dsfTotal = ratio(*magnitude(referenceB,referenceErr),*magnitude(insideB,insideErr))
+    return {'position':grid,'sf':sf,'dsf':dsf,'sfTotal':sfTotal,'dsfTotal':dsfTotal,
+            'mask':insideMask & referenceMask}
+
+
+def cachedShieldingFactor(inside,reference,insideOff=None,referenceOff=None,grid=None,step=None,cacheDir=CACHE):
+    """shieldingFactor, computed only once for each set of run versions and
+       settings
+
+    Args:
+        as for shieldingFactor
+        cacheDir (string, optional): folder for the cached results, shared
+            with RunLoader. Defaults to '.runcache'.
+
+    Returns:
+        dict: as for shieldingFactor
+    """
+    key = []
+    for paths in [inside,reference,insideOff or [],referenceOff or []]:
+        stats = [os.stat(path) for path in paths]
+        key.append([[os.path.abspath(path),stat.st_size,stat.st_mtime_ns] for path,stat in zip(paths,stats)])
+    key.append([None if grid is None else np.asarray(grid,dtype=float).tolist(),step])
+    cached = os.path.join(cacheDir,'sf-{}.npz'.format(hashlib.sha1(json.dumps(key).encode()).hexdigest()))
+    if os.path.exists(cached):
+        with np.load(cached) as f:
+            return {name:f[name] for name in f.files}
+
+    result = shieldingFactor(inside,reference,insideOff,referenceOff,grid,step)
+    os.makedirs(cacheDir,exist_ok=True)
+    saveCache(cached,**result)
+    return result
+
+
+def expand(patterns):
+    """
+    Returns:
+        List[string]: the files matching any of the glob patterns, sorted
+    """
+    return sorted({path for pattern in patterns or [] for path in glob.glob(pattern)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='shielding factor profile from coil runs inside and outside the shield')
+    parser.add_argument('--inside',nargs='+',required=True,help='runs (or glob patterns) inside the shield, coil on')
+    parser.add_argument('--reference',nargs='+',required=True,help='runs without the shield, coil on')
+    parser.add_argument('--inside-off',nargs='+',help='runs inside the shield, coil off')
+    parser.add_argument('--reference-off',nargs='+',help='runs without the shield, coil off')
+    parser.add_argument('--step',type=float,help='grid spacing in cm')
+    parser.add_argument('--out',help='save the profile to this .csv')
+    args = parser.parse_args()
+
+    inside = expand(args.inside)
+    reference = expand(args.reference)
+    for option,paths in [('--inside',inside),('--reference',reference)]:
+        if not paths:
+            parser.error('{} matches no files'.format(option))
+    result = cachedShieldingFactor(inside,reference,expand(args.inside_off),expand(args.reference_off),step=args.step)
+    position = result['position']
+    columns = np.column_stack([position,result['sf'],result['dsf'],result['sfTotal'],result['dsfTotal']])
+    names = (['position']+['sf_'+name for name in AXES]+['dsf_'+name for name in AXES]
+             +['sf_total1','sf_total2','dsf_total1','dsf_total2'])
+    if args.out:
+        np.savetxt(args.out,columns,delimiter=',',header=','.join(names),comments='')
+        print('profile saved to {}'.format(args.out))
+    shielded = (position >= SHIELDSTART) & (position <= SHIELDSTOP)
+    for i,name in enumerate(AXES):
+        values = result['sf'][shielded & result['mask'][:,i],i]
+        if len(values):
+            print('{}: shielding factor {:.1f} (median between {} and {}cm)'.format(name,np.median(values),SHIELDSTART,SHIELDSTOP))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#SIMULATION
+
+"""
+Simulated stand-ins for the gradiometer hardware, so Gradiometer.posRun,
+timeRun and the GUIs can be run and benchmarked without a LabJack U6 or
+MotorHAT attached, e.g.
+
+    from Simulation import simulatedBackend
+    g = Gradiometer(*simulatedBackend(speedup=10))
+
+SimU6 implements the parts of u6.U6 the gradiometer uses (readRegister and the
+stream functions) and SimMotor the parts of Motor. Both share a SimRig that
+holds the carriage position and a field model. All delays are divided by
+speedup, so speedup=1 runs at realistic speed and larger values run faster
+than real time.
+"""
+
+import time
+import numpy as np
+
+from Geometry import OFFSETS, SHIELDSTART, SHIELDSTOP
+
+class SimRig:
+    """the simulated carriage and the field the fluxgates see
+    """
+
+    # shield ends in cm
+    SHIELDSTART = SHIELDSTART
+    SHIELDSTOP = SHIELDSTOP
+    # offsets of the x, y and z sensing points from the measured position in cm
+    OFFSETS = OFFSETS[:3]
+
+    def __init__(self,speedup=1,noise=0.002,vibration=0.02,settleTime=0.05,seed=None):
+        """
+        Args:
+            speedup (float, optional): how much faster than real time to run.
+                Defaults to 1.
+            noise (float, optional): stdev in V of the fluxgate noise.
+                Defaults to 0.002.
+            vibration (float, optional): stdev in V of the extra noise right
+                after a step. Defaults to 0.02.
+            settleTime (float, optional): time constant in s of the vibration
+                dying away. Defaults to 0.05.
+            seed (int, optional): random seed. Defaults to None.
+        """
+        self.speedup = speedup
+        self.noise = noise
+        self.vibration = vibration
+        self.settleTime = settleTime
+        self.rng = np.random.default_rng(seed)
+        # carriage position in cm, increases when stepping BACKWARD like
+        # Gradiometer.oneStep
+        self.pos = 0.0
+        self.lastStep = -np.inf
+        self.start = time.perf_counter()
+
+    def now(self):
+        """simulated time in s since the rig was created
+        """
+        return (time.perf_counter()-self.start)*self.speedup
+
+    def sleep(self,sec):
+        """sleeps for sec seconds of simulated time
+        """
+        if sec > 0:
+            time.sleep(sec/self.speedup)
+
+    def field(self,pos):
+        """field model in V for the six AINs with fluxgate 1 at pos
+
+        Args:
+            pos (float_array(n,)): fluxgate 1 y positions in cm
+
+        Returns:
+            float_array(n,6): x1,y1,z1,x2,y2,z2 without noise
+        """
+        pos = np.asarray(pos,dtype=float)[:,None]+self.OFFSETS
+        # smooth drop of the field inside the shield
+        inside = 1/(1+np.exp(-(pos-self.SHIELDSTART)))-1/(1+np.exp(-(pos-self.SHIELDSTOP)))
+        fg1 = np.array([0.9,0.8,-0.4])*(1-0.95*inside)
+        # fluxgate 2 stays put and sees a constant field
+        fg2 = np.broadcast_to([-0.24,-3.68,-1.11],fg1.shape)
+        return np.concatenate((fg1,fg2),1)
+
+    def read(self,t):
+        """noisy readings of the six AINs at simulated times t
+
+        Args:
+            t (float_array(n,)): simulated times in s
+
+        Returns:
+            float_array(n,6): x1,y1,z1,x2,y2,z2
+        """
+        t = np.asarray(t,dtype=float)
+        sigma = self.noise+self.vibration*np.exp(-np.maximum(t-self.lastStep,0)/self.settleTime)
+        values = self.field(np.full(len(t),self.pos))
+        return values+self.rng.normal(0,1,values.shape)*sigma[:,None]
+
+
+class SimU6:
+    """simulated LabJack U6 with the readRegister and stream interface of u6.U6
+    """
+
+    # U6 stream buffer in samples, anything beyond it is missed
+    BUFFER = 984
+    # saved with every run, so simulated runs can be told from real ones
+    SIMULATED = True
+
+    def __init__(self,rig,latency=0.001):
+        """
+        Args:
+            rig (SimRig): the simulated rig to read from
+            latency (float, optional): USB command/response time in s.
+                Defaults to 0.001.
+        """
+        self.rig = rig
+        self.latency = latency
+        self.packetsPerRequest = 48
+        self.streamSamplesPerPacket = 25
+        self.numChannels = 6
+        self.scanFreq = 1000
+        self.streaming = False
+
+    def getCalibrationData(self):
+        self.rig.sleep(self.latency)
+
+    def readRegister(self,addr,numReg):
+        """reads numReg//2 AINs starting at AIN addr//2 as floats
+        """
+        self.rig.sleep(self.latency)
+        return list(self.rig.read([self.rig.now()])[0,addr//2:(addr+numReg)//2])
+
+    def streamConfig(self,NumChannels=1,ResolutionIndex=0,SamplesPerPacket=25,SettlingFactor=0,ChannelNumbers=[0],ChannelOptions=[0],ScanFrequency=None,**kwargs):
+        self.rig.sleep(self.latency)
+        self.numChannels = NumChannels
+        self.channelNumbers = list(ChannelNumbers)
+        self.scanFreq = ScanFrequency
+        self.streamSamplesPerPacket = SamplesPerPacket
+        self.packetsPerRequest = 48 if SamplesPerPacket == 25 else 1
+
+    def streamStart(self):
+        self.rig.sleep(self.latency)
+        self.streaming = True
+        self.streamStartTime = self.rig.now()
+        # samples handed out so far, and the channel the next one belongs to
+        self.sampleCount = 0
+
+    def streamStop(self):
+        self.rig.sleep(self.latency)
+        self.streaming = False
+
+    def streamData(self):
+        """yields results like u6.U6.streamData(), one per request of
+           packetsPerRequest packets, waiting until the simulated device has
+           taken the samples. If the reader falls further behind than the
+           device buffer the oldest samples are reported as missed
+        """
+        sampleFreq = self.scanFreq*self.numChannels
+        while self.streaming:
+            n = self.packetsPerRequest*self.streamSamplesPerPacket
+            missed = 0
+            # samples the device has taken but nobody has read yet
+            backlog = (self.rig.now()-self.streamStartTime)*sampleFreq-self.sampleCount
+            if backlog > self.BUFFER+n:
+                # whole scans are dropped, like the U6 auto-recovery
+                missed = int((backlog-self.BUFFER-n)//self.numChannels)
+                self.sampleCount += missed*self.numChannels
+            due = self.streamStartTime+(self.sampleCount+n)/sampleFreq
+            self.rig.sleep(due-self.rig.now()+self.latency)
+            sample = self.sampleCount+np.arange(n)
+            channel = sample%self.numChannels
+            scan = sample//self.numChannels
+            values = self.rig.read(self.streamStartTime+scan/self.scanFreq)
+            r = {'errors':0,'numPackets':self.packetsPerRequest,'missed':missed,'firstPacket':0}
+            for i,c in enumerate(self.channelNumbers):
+                r['AIN{}'.format(c)] = list(values[channel==i,c])
+            self.sampleCount += n
+            yield r
+
+    def close(self):
+        self.streaming = False
+
+
+class SimStepper:
+    """simulated Adafruit_StepperMotor
+    """
+
+    def __init__(self,rig,motor,stepTime):
+        self.rig = rig
+        self.motor = motor
+        self.stepTime = stepTime
+        self.rpm = 30
+
+    def setSpeed(self,rpm):
+        self.rpm = rpm
+
+    def oneStep(self,direction,style):
+        self.rig.sleep(self.stepTime)
+        sign = 1 if direction == SimMotorHAT.BACKWARD else -1
+        # after a reversal the first steps only take up the belt slack
+        if (sign > 0 and self.motor.slack < self.motor.backlash) or (sign < 0 and self.motor.slack > 0):
+            self.motor.slack += sign
+        else:
+            self.rig.pos += self.motor.cmPerStep*sign
+        self.rig.lastStep = self.rig.now()
+
+    def step(self,steps,direction,style):
+        # the Adafruit library waits 60/(200*rpm) s between steps
+        for i in range(steps):
+            self.oneStep(direction,style)
+            self.rig.sleep(60/(200*self.rpm))
+
+
+class SimMotorHAT:
+    """constants of Adafruit_MotorHAT
+    """
+    FORWARD = 1
+    BACKWARD = 2
+    BRAKE = 3
+    RELEASE = 4
+    SINGLE = 1
+    DOUBLE = 2
+    INTERLEAVE = 3
+    MICROSTEP = 4
+
+
+class SimMotor:
+    """simulated Motor, with the same mh and myStepper attributes
+    """
+
+    def __init__(self,rig,cmPerStep=0.082268,stepTime=0.003,backlash=3):
+        """
+        Args:
+            rig (SimRig): the simulated rig to move
+            cmPerStep (float, optional): carriage travel per step. Defaults to
+                0.082268.
+            stepTime (float, optional): time in s for the I2C writes of one
+                step. Defaults to 0.003.
+            backlash (int, optional): steps after a reversal before the
+                carriage moves. Defaults to 3.
+        """
+        self.rig = rig
+        self.cmPerStep = cmPerStep
+        self.backlash = backlash
+        # slack taken up towards BACKWARD steps, starts engaged for them
+        self.slack = backlash
+        self.mh = SimMotorHAT()
+        self.myStepper = SimStepper(rig,self,stepTime)
+        self.myStepper.setSpeed(30)
+
+    def turnOffMotors(self):
+        print('motor turned off')
+
+
+def simulatedBackend(speedup=1,backlash=3,**kwargs):
+    """makes a simulated labjack and motor sharing one rig
+
+    Args:
+        speedup (float, optional): how much faster than real time to run.
+            Defaults to 1.
+        backlash (int, optional): belt backlash of the motor in steps.
+            Defaults to 3.
+        **kwargs: passed on to SimRig
+
+    Returns:
+        tuple (SimU6, SimMotor): to be passed to Gradiometer(labjack, motor)
+    """
+    rig = SimRig(speedup,**kwargs)
+    return SimU6(rig),SimMotor(rig,backlash=backlash)
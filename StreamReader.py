@@ -0,0 +1,66 @@
+#STREAM READER
+
+import threading
+import queue
+from datetime import datetime
+
+class StreamReader(threading.Thread):
+    """reads labjack stream results on a dedicated thread and pushes them into
+       a bounded queue, so that slow disk writes or GUI callbacks in the
+       consumer don't delay the next USB read
+    """
+
+    # put on the queue once the reader has stopped
+    DONE = None
+
+    def __init__(self,labjack,maxsize=64):
+        """
+        Args:
+            labjack (u6.U6): a labjack with a configured and started stream
+            maxsize (int, optional): maximum number of stream results held in
+                the queue before the reader blocks. Defaults to 64.
+        """
+        super().__init__(daemon=True)
+        self.labjack = labjack
+        self.queue = queue.Queue(maxsize)
+        self.highWater = 0
+        self.error = None
+        self._stopEvent = threading.Event()
+
+    def run(self):
+        try:
+            for r in self.labjack.streamData():
+                if self._stopEvent.is_set():
+                    break
+                # stamp the result when it was read, not when it is consumed
+                self.queue.put((datetime.now(),r))
+                self.highWater = max(self.highWater,self.queue.qsize())
+        except Exception as e:
+            self.error = e
+        finally:
+            self.queue.put(self.DONE)
+
+    def get(self):
+        """gets the next stream result, blocking until one is available
+
+        Returns:
+            tuple (datetime, dict): time the result was read and the result
+                from labjack.streamData() (which may itself be None if no data
+                was returned), or StreamReader.DONE once the reader has stopped
+        """
+        item = self.queue.get()
+        if item is self.DONE and self.error is not None:
+            raise self.error
+        return item
+
+    def stop(self):
+        """stops the reader and waits for it to finish, dropping any results
+           still in the queue so a blocked reader can exit
+        """
+        self._stopEvent.set()
+        while self.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.join()
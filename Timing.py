@@ -0,0 +1,110 @@
+#TIMING
+
+import csv
+import math
+import time
+
+class StageTimer:
+    """records how long each stage of a run's hot loop takes (stepping,
+       sampling, printing, writing...) into a log spaced histogram per stage,
+       so long runs cost a few list increments per stage and no memory growth
+    """
+
+    # histogram buckets per decade, and the range covered (1us to 100s)
+    PER_DECADE = 10
+    MIN = 1e-6
+    BUCKETS = 80
+
+    def __init__(self):
+        self.hist = {}
+        self.total = {}
+        self.max = {}
+
+    def start(self):
+        """
+        Returns:
+            float: the current time, to be passed to record
+        """
+        return time.perf_counter()
+
+    def record(self,stage,start):
+        """records the time since start against stage
+
+        Args:
+            stage (string): name of the stage
+            start (float): time returned by start() when the stage began
+
+        Returns:
+            float: the current time, so consecutive stages can be chained
+        """
+        now = time.perf_counter()
+        d = now-start
+        if stage not in self.hist:
+            self.hist[stage] = [0]*self.BUCKETS
+            self.total[stage] = 0
+            self.max[stage] = 0
+        i = int(self.PER_DECADE*math.log10(d/self.MIN)) if d > self.MIN else 0
+        self.hist[stage][min(max(i,0),self.BUCKETS-1)] += 1
+        self.total[stage] += d
+        if d > self.max[stage]:
+            self.max[stage] = d
+        return now
+
+    def percentile(self,stage,q):
+        """
+        Args:
+            stage (string): name of the stage
+            q (float): percentile, 0 to 100
+
+        Returns:
+            float: upper edge in seconds of the histogram bucket holding the
+                q-th percentile
+        """
+        hist = self.hist[stage]
+        target = q/100*sum(hist)
+        count = 0
+        for i,n in enumerate(hist):
+            count += n
+            if count >= target and n:
+                return min(self.MIN*10**((i+1)/self.PER_DECADE),self.max[stage])
+        return self.max[stage]
+
+    def summary(self):
+        """
+        Returns:
+            list of dict: count, total, p50, p95 and max in seconds per stage
+        """
+        return [{'stage':stage,'count':sum(self.hist[stage]),'total':self.total[stage],
+                 'p50':self.percentile(stage,50),'p95':self.percentile(stage,95),
+                 'max':self.max[stage]} for stage in self.hist]
+
+    def report(self,filename=None):
+        """prints the summary and, if a filename is given, saves it as .csv
+
+        Args:
+            filename (string, optional): where to save the summary. Defaults to
+                None.
+        """
+        summary = self.summary()
+        for s in summary:
+            print('{:>10}: n={:<6d} total={:8.3f}s p50={:8.2f}ms p95={:8.2f}ms max={:8.2f}ms'.format(
+                s['stage'],s['count'],s['total'],1e3*s['p50'],1e3*s['p95'],1e3*s['max']))
+        if filename and summary:
+            with open(filename,'w') as f:
+                writer = csv.DictWriter(f,['stage','count','total','p50','p95','max'])
+                writer.writeheader()
+                writer.writerows(summary)
+
+
+class NullTimer(StageTimer):
+    """a StageTimer that records nothing, used when timing is turned off
+    """
+
+    def start(self):
+        return 0
+
+    def record(self,stage,start):
+        return 0
+
+    def report(self,filename=None):
+        pass
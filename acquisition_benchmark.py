@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Automated version of user_manual_test.py. Runs the same posRun and timeRun
+scenarios against the simulated backend (default) or the real gradiometer
+(--real), records positions/s, effective samples/s, missed samples, CPU and
+how much each raised the peak memory, and saves the results as json in
+Benchmarks/. The run files themselves go to a scratch directory that is
+deleted afterwards, so they never show up in Run_Data or its catalog. Pass
+--compare with an earlier results file to flag regressions.
+
+    python acquisition_benchmark.py --speedup 5
+    python acquisition_benchmark.py --compare Benchmarks/2020-09-04_08-04-12.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import contextlib
+from datetime import datetime
+
+from Gradiometer import Gradiometer
+from Simulation import simulatedBackend
+
+# (name, method, kwargs), same runs as user_manual_test.py
+SCENARIOS = [
+    ('pos5','posRun',{'start':0,'stop':10}),
+    ('pos10','posRun',{'start':0,'stop':10,'samples_per_pos':10}),
+    ('pos50','posRun',{'start':0,'stop':10,'samples_per_pos':50}),
+    ('pos50burst','posRun',{'start':0,'stop':10,'samples_per_pos':50,'burst':True}),
+    ('time500','timeRun',{'sec':5,'scanFreq':500}),
+    ('time1000','timeRun',{'sec':5}),
+    ('time2000','timeRun',{'sec':5,'scanFreq':2000}),
+    ('time8000','timeRun',{'sec':5,'scanFreq':8000}),
+]
+# metrics where a drop is a regression, and ones where a rise is
+HIGHER_IS_BETTER = ['positions_per_s','samples_per_s']
+LOWER_IS_BETTER = ['missed']
+
+def runScenario(g,name,method,kwargs,speedup,directory):
+    """runs one scenario and measures it, saving the run in directory
+
+    Returns:
+        dict: metrics of the scenario
+    """
+    g.goTo(0)
+    if method == 'timeRun':
+        # timeRun stops once more than sec whole seconds have passed on the host clock, so
+        # sec+1 is scaled down and rounded, never below one second; the simulated length
+        # then depends on speedup and the rates below use the time the run actually took
+        kwargs = dict(kwargs,sec=max(round((kwargs['sec']+1)/speedup)-1,0))
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    # the per-measurement prints would dominate the timing
+    with open(os.devnull,'w') as devnull, contextlib.redirect_stdout(devnull):
+        summary = getattr(g,method)(tag='bench-'+name,directory=directory,**kwargs)
+    wall = time.perf_counter()-wall
+    cpu = time.process_time()-cpu
+    # rates are given in simulated (device) time so they compare across speedups
+    seconds = summary['seconds']*speedup
+    # ru_maxrss is the peak of the whole process, so only the amount this scenario raised it is its own
+    result = {'seconds':seconds,'cpu_fraction':cpu/wall,
+              'max_rss_growth_kb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss-rss}
+    if method == 'posRun':
+        result['positions_per_s'] = summary['positions']/seconds
+        result['samples_per_s'] = summary['samples']/seconds
+        result['missed'] = 0
+    else:
+        result['samples_per_s'] = summary['scans']*6/seconds
+        result['missed'] = summary['missed']
+        result['queue_high_water'] = summary['highWater']
+    return result
+
+def compare(results,previous,tolerance):
+    """prints the change of every metric against an earlier results file
+
+    Returns:
+        int: number of regressions found
+    """
+    regressions = 0
+    for name,metrics in results['scenarios'].items():
+        if name not in previous['scenarios']:
+            continue
+        old = previous['scenarios'][name]
+        for key in HIGHER_IS_BETTER+LOWER_IS_BETTER:
+            if key not in metrics or key not in old:
+                continue
+            if key in HIGHER_IS_BETTER:
+                worse = metrics[key] < old[key]*(1-tolerance)
+            else:
+                worse = metrics[key] > old[key]*(1+tolerance)
+            regressions += worse
+            print('{:>12} {:>16}: {:12.1f} -> {:12.1f} {}'.format(name,key,old[key],metrics[key],'REGRESSION' if worse else ''))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--real',action='store_true',help='use the real labjack and motor')
+    parser.add_argument('--speedup',type=float,default=1,help='simulation speed relative to real time')
+    parser.add_argument('--only',nargs='*',help='names of the scenarios to run')
+    parser.add_argument('--compare',help='earlier results .json to compare against')
+    parser.add_argument('--tolerance',type=float,default=0.1,help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.real:
+        g = Gradiometer()
+        speedup = 1
+    else:
+        g = Gradiometer(*simulatedBackend(args.speedup))
+        speedup = args.speedup
+    g.zero()
+
+    results = {'date':datetime.now().isoformat(),'backend':'real' if args.real else 'simulated',
+               'speedup':speedup,'scenarios':{}}
+    scratch = tempfile.TemporaryDirectory(prefix='bench-')
+    try:
+        for name,method,kwargs in SCENARIOS:
+            if args.only and name not in args.only:
+                continue
+            results['scenarios'][name] = runScenario(g,name,method,kwargs,speedup,scratch.name)
+            print('{:>12}: {}'.format(name,', '.join('{}={:.4g}'.format(k,v) for k,v in results['scenarios'][name].items())))
+    finally:
+        g.goTo(0)
+        g.motor.turnOffMotors()
+        g.savePos()
+        g.labjack.close()
+        scratch.cleanup()
+
+    os.makedirs('Benchmarks',exist_ok=True)
+    filename = 'Benchmarks/{}.json'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+    with open(filename,'w') as f:
+        json.dump(results,f,indent=2)
+    print('results saved to {}'.format(filename))
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(results,previous,args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Finds the fastest goTo motion profile the motor keeps up with and saves it to
+config.json (see Gradiometer.setMotion). Until this has been done goTo steps
+at the motor's 30 RPM without a ramp.
+
+Mark the carriage's position on the rail before starting. For every speed, from
+slowest to fastest, the carriage goes --distance cm out and back --laps times
+with that profile. Lost steps leave it short of the mark, so check it and
+answer. The fastest speed that came back to the mark, times --margin, is saved:
+
+    python motion_calibration.py --speeds 8 12 16 20 24 --acceleration 40
+    python motion_calibration.py --speeds 10 15 --simulate     (dry run, saves nothing)
+
+If a speed fails, put the carriage back on the mark before running this again,
+since the saved position is off by the lost steps.
+"""
+
+import atexit
+import argparse
+
+from Gradiometer import Gradiometer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--speeds',nargs='+',type=float,required=True,help='top speeds to try in cm/s')
+    parser.add_argument('--acceleration',type=float,default=Gradiometer.ACCELERATION,help='(peak) acceleration in cm/s^2')
+    parser.add_argument('--profile',default=Gradiometer.PROFILE,choices=['trapezoid','scurve'])
+    parser.add_argument('--distance',type=float,default=40,help='length of each lap in cm')
+    parser.add_argument('--laps',type=int,default=5)
+    parser.add_argument('--margin',type=float,default=0.8,help='fraction of the fastest good speed to save')
+    parser.add_argument('--simulate',action='store_true',help='use the simulated labjack and motor')
+    args = parser.parse_args()
+
+    if args.simulate:
+        from Simulation import simulatedBackend
+        g = Gradiometer(*simulatedBackend(10))
+    else:
+        g = Gradiometer()
+    atexit.register(g.motor.turnOffMotors)
+    atexit.register(g.savePos)
+    g.zero()
+
+    passed = None
+    for speed in sorted(args.speeds):
+        g.MAX_SPEED,g.ACCELERATION,g.PROFILE = speed,args.acceleration,args.profile
+        for lap in range(args.laps):
+            g.goTo(args.distance,fast=True)
+            g.goTo(0,fast=True)
+        if input('{}cm/s: is the carriage back on the mark? [y/n] '.format(speed)).strip().lower() != 'y':
+            print('steps were lost at {}cm/s, put the carriage back on the mark'.format(speed))
+            break
+        passed = speed
+
+    if passed is None:
+        print('no speed kept up, config.json left unchanged')
+        return
+    if args.simulate:
+        print('dry run, would save MAX_SPEED={:.2f}cm/s'.format(passed*args.margin))
+        return
+    g.setMotion(passed*args.margin,args.acceleration,args.profile)
+    print('saved MAX_SPEED={:.2f}cm/s ACCELERATION={}cm/s^2 PROFILE={} to config.json'.format(g.MAX_SPEED,g.ACCELERATION,g.PROFILE))
+
+if __name__ == '__main__':
+    main()
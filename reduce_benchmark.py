@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark for the per-packet reduction done in Gradiometer.timeRun.
+Compares the old per-channel python reduction with Fluxgate.reducePacket on
+synthetic stream results shaped like the ones the U6 returns (48 packets of
+25 samples per request, spread over 6 AINs). Needs no hardware.
+"""
+
+import timeit
+import numpy as np
+
+from Fluxgate import AIN_KEYS, reducePacket
+
+PACKETS_PER_REQUEST = 48
+SAMPLES_PER_PACKET = 25
+REPEATS = 2000
+
+def makePacket(rng):
+    scans = PACKETS_PER_REQUEST*SAMPLES_PER_PACKET//len(AIN_KEYS)
+    return {key:list(rng.normal(0,1,scans)) for key in AIN_KEYS}
+
+def oldReduce(r):
+    # the reduction timeRun used before reducePacket
+    vals = [sum(r[key])/len(r[key]) for key in AIN_KEYS]
+    stds = [np.std(r[key]) for key in AIN_KEYS]
+    return vals, stds
+
+r = makePacket(np.random.default_rng(0))
+old = np.array(oldReduce(r))
+new = reducePacket(r)
+assert np.allclose(old[0],new[0].ravel()) and np.allclose(old[1],new[1].ravel())
+
+for name,func in [('old',oldReduce),('reducePacket',reducePacket)]:
+    t = min(timeit.repeat(lambda: func(r),number=REPEATS,repeat=3))
+    print('{:>12}: {:8.0f} packets/s ({:.1f} us/packet)'.format(name,REPEATS/t,1e6*t/REPEATS))
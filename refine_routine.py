@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Coarse-to-fine version of full_length_routine.py: a 1cm coarse pass over the
+whole length, then full step resolution only around foils and shield ends.
+"""
+
+from Gradiometer import Gradiometer
+import atexit
+
+g=Gradiometer()
+atexit.register(g.motor.turnOffMotors)
+atexit.register(g.savePos)
+atexit.register(g.labjack.close)
+g.zero()
+foilNum = input('foil number? \n')
+direction = input('par or perp? \n')
+g.refineRun(0, 80, 'foil{}-{}-refine'.format(foilNum,direction))
+g.goTo(0)
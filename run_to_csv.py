@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""
+Converts .run files written with fmt='run' to .csv files with the usual
+columns, for anything that still reads the csv format. The .csv is written
+next to the .run, and RunCatalog and Background skip it while the .run is
+there so the run isn't counted twice.
+
+    python run_to_csv.py Run_Data/2020-09-09_16-38-47-pos5.run
+    python run_to_csv.py            (converts every .run in Run_Data/)
+"""
+
+import sys
+import glob
+
+from RunFile import runToCsv
+
+filenames = sys.argv[1:] or sorted(glob.glob('Run_Data/*.run'))
+for filename in filenames:
+    print('{} -> {}'.format(filename,runToCsv(filename)))
@@ -17,6 +17,7 @@ g.zero()
 g.posRun(0,10,'pos5')
 g.posRun(0,10,'pos10',samples_per_pos=10)
 g.posRun(0,10,'pos50',samples_per_pos=50)
+g.posRun(0,10,'pos50burst',samples_per_pos=50,burst=True)
 
 g.timeRun(5,'time1000')
 g.timeRun(5,'time500',scanFreq=500)